@@ -0,0 +1,7 @@
+'''性能测试脚本，在 fastapi 目录下以 python -m bench.xxx 运行
+
+默认连接 mongodb://localhost 的 V2EX_bench 库，可用 MONGO_URL / MONGO_DB 覆盖'''
+import os
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost')
+os.environ.setdefault('MONGO_DB', 'V2EX_bench')
@@ -0,0 +1,149 @@
+'''首页查询性能对比: 逐日查询 vs 单次聚合 vs 日榜
+
+python -m bench.home [--seed] [--rounds 50]
+'''
+from pymongo import monitoring
+import statistics
+import datetime
+import argparse
+import asyncio
+import random
+import time
+
+import bench  # noqa: F401 设置测试库
+
+
+class CommandCounter(monitoring.CommandListener):
+    '''统计发往 Mongo 的命令数（即往返次数）'''
+    count = 0
+
+    def started(self, event):
+        CommandCounter.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+monitoring.register(CommandCounter())
+
+from database import db  # noqa: E402 需要在注册监听之后创建连接
+from tools import TOPIC_LIST_FIELDS, REPLY_LIST_FIELDS  # noqa: E402
+from leaderboard import rebuild, top_by_day  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+
+
+async def seed(days=365 * 3, per_day=200):
+    '''生成每天 per_day 个主题及回复'''
+    await db.topic.drop()
+    await db.reply.drop()
+    await ensure_indexes()
+    now = datetime.datetime.now()
+    topic_id = reply_id = 0
+    for d in range(days):
+        topics, replys = [], []
+        for _ in range(per_day):
+            topic_id += 1
+            reply_id += 1
+            date = now - datetime.timedelta(days=d, seconds=random.randint(0, 86399))
+            topics.append({
+                'id': topic_id, 'name': f'topic {topic_id}', 'node': 'qna',
+                'author': 'bench', 'avatar': '', 'date': date, 'spiderTime': now,
+                'reply': 0, 'score': random.randint(0, 20000), 'content': 'x' * 2000,
+            })
+            replys.append({
+                'id': reply_id, 'topicId': topic_id, 'topicPage': 1,
+                'author': 'bench', 'avatar': '', 'date': date, 'spiderTime': now,
+                'thank': random.randint(0, 200), 'content': 'y' * 500,
+            })
+        await db.topic.insert_many(topics)
+        await db.reply.insert_many(replys)
+    await db.leaderboard.drop()
+    await rebuild((now - datetime.timedelta(days=days)).date(), now.date())
+
+
+async def legacy(days):
+    '''原逐日查询实现'''
+    topics, replys = [], []
+    for i in days:
+        day = datetime.datetime.now() - datetime.timedelta(days=i)
+        topics += await db.topic.find({'date': {
+            '$gte': day.replace(hour=0, minute=0, second=0),
+            '$lt': day.replace(hour=23, minute=59, second=59)
+        }}).sort('score', -1).limit(3).to_list(3)
+    for i in days:
+        day = datetime.datetime.now() - datetime.timedelta(days=i)
+        replys += await db.reply.find({'date': {
+            '$gte': day.replace(hour=0, minute=0, second=0),
+            '$lt': day.replace(hour=23, minute=59, second=59)
+        }}).sort('thank', -1).limit(3).to_list(3)
+    return topics, replys
+
+
+async def aggregated_top(collection, days, sort_key, fields, limit=3):
+    '''单次聚合取出多个日期各自前 limit 的文档'''
+    now = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    starts = [now - datetime.timedelta(days=i) for i in days]
+    pipeline = [
+        {'$match': {'$or': [
+            {'date': {'$gte': i, '$lt': i + datetime.timedelta(days=1)}} for i in starts
+        ]}},
+        {'$project': {
+            **{i: 1 for i in fields},
+            'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+        }},
+        {'$sort': {sort_key: -1}},
+        {'$group': {'_id': '$day', 'docs': {'$push': '$$ROOT'}}},
+        {'$project': {'docs': {'$slice': ['$docs', limit]}}},
+    ]
+    groups = await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    groups = {i['_id']: i['docs'] for i in groups}
+    return [d for i in starts for d in groups.get(f'{i:%Y-%m-%d}', [])]
+
+
+async def aggregated(days):
+    return await asyncio.gather(
+        aggregated_top(db.topic, days, 'score', TOPIC_LIST_FIELDS),
+        aggregated_top(db.reply, days, 'thank', REPLY_LIST_FIELDS),
+    )
+
+
+async def leaderboard(days):
+    return await asyncio.gather(
+        top_by_day('topic', days),
+        top_by_day('reply', days),
+    )
+
+
+async def measure(func, rounds):
+    latencies = []
+    CommandCounter.count = 0
+    for _ in range(rounds):
+        days = list(range(1, 8)) + [random.randint(8, 365 * 3) for _ in range(10)]
+        start = time.perf_counter()
+        await func(days)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'round_trips': CommandCounter.count / rounds,
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', action='store_true', help='重新生成测试数据')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.seed:
+        await seed()
+    for func in (legacy, aggregated, leaderboard):
+        print(func.__name__, await measure(func, args.rounds))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,226 @@
+'''模拟扩展客户端压测: 爬虫客户端领取任务并提交主题，浏览客户端访问首页、榜单及推荐
+
+python -m bench.seed --topics 1000000         # 先生成测试数据
+python -m bench.load [--crawlers 20] [--readers 50] [--duration 60] [--out bench.jsonl]
+python -m bench.load --url http://localhost:8000  # 压测已启动的服务（如 gunicorn）
+
+不指定 --url 时在进程内通过 ASGI 直接调用应用，不经过网络；
+每个模拟客户端使用各自的来源地址（ASGI 的 client 或绑定不同的 127.x 本地地址），
+不伪造 X-Forwarded-For，按客户端限流与线上一致；--url 须指向本机回环地址且不经反向代理；
+结果按路由统计吞吐量及延迟分位数，输出一行 JSON，--out 时追加到文件，便于跨提交对比'''
+from collections import defaultdict, Counter
+import subprocess
+import datetime
+import argparse
+import asyncio
+import random
+import time
+import json
+
+import httpx
+
+import bench  # noqa: F401 设置测试库
+
+# 浏览客户端访问的路由: (路由, 权重, 生成请求参数)
+READER_ROUTES = [
+    ('/', 20, lambda: {}),
+    ('/rank', 10, lambda: {}),
+    ('/api/rank', 10, lambda: {'kind': random.choice(['topic', 'reply'])}),
+    ('/api/topic/recommend', 30, lambda: {}),
+    ('/api/reply/recommend', 30, lambda: {}),
+]
+
+# 扩展用户浏览时提交的热门主题，多个客户端反复提交同一主题
+HOT_TOPICS = 200
+
+# 浏览榜单时最多继续翻的页数
+RANK_PAGES = 3
+
+
+class Recorder:
+    '''按路由记录状态码及耗时，预热期间不记录'''
+
+    def __init__(self):
+        self.recording = False
+        self.latencies = defaultdict(list)
+        self.status = defaultdict(Counter)
+
+    def add(self, route: str, status, seconds: float):
+        if self.recording:
+            self.latencies[route].append(seconds * 1000)
+            self.status[route][str(status)] += 1
+
+    @staticmethod
+    def summary(latencies: list, status: Counter, duration: float) -> dict:
+        latencies = sorted(latencies)
+        n = len(latencies)
+
+        def percentile(q):
+            return round(latencies[min(n - 1, int(n * q))], 2) if n else None
+
+        return {
+            'requests': n,
+            'rps': round(n / duration, 1),
+            'errors': sum(v for k, v in status.items() if not k.isdigit() or int(k) >= 500),
+            'status': dict(status),
+            'mean_ms': round(sum(latencies) / n, 2) if n else None,
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'max_ms': percentile(1),
+        }
+
+    def report(self, duration: float) -> dict:
+        routes = {i: self.summary(self.latencies[i], self.status[i], duration) for i in sorted(self.latencies)}
+        total = self.summary(
+            [v for i in self.latencies.values() for v in i],
+            sum(self.status.values(), Counter()),
+            duration,
+        )
+        return {'routes': routes, 'total': total}
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, route: str, method: str, **kwargs):
+    start = time.perf_counter()
+    try:
+        resp = await client.request(method, route, **kwargs)
+        status = resp.status_code
+    except httpx.HTTPError as e:
+        resp, status = None, type(e).__name__
+    recorder.add(route, status, time.perf_counter() - start)
+    return resp
+
+
+def fake_topic(topic_id: int, page: int) -> dict:
+    now = datetime.datetime.now()
+    date = now - datetime.timedelta(hours=random.uniform(0, 48))
+    return {
+        'spiderTime': now.isoformat(), 'id': topic_id, 'name': f'模拟主题 {topic_id}', 'node': 'qna',
+        'author': 'bench', 'avatar': 'https://cdn.v2ex.com/avatar/bench.png', 'date': date.isoformat(),
+        'reply': random.randint(0, 200), 'vote': random.randint(0, 5), 'click': random.randint(0, 5000),
+        'collect': random.randint(0, 20), 'thank': random.randint(0, 5), 'score': random.randint(0, 3000),
+        'content': '<p>' + '内容' * random.randint(50, 1000) + '</p>', 'append': [],
+        'replys': [{
+            'spiderTime': now.isoformat(), 'topicId': topic_id, 'topicPage': page,
+            'id': topic_id * 1000 + page * 100 + i, 'author': 'bench',
+            'avatar': 'https://cdn.v2ex.com/avatar/bench.png', 'date': date.isoformat(),
+            'thank': random.randint(1, 50), 'content': '回复内容' * random.randint(5, 50),
+        } for i in range(random.randint(0, 5))],
+    }
+
+
+def make_client(url: str, app, address: str) -> httpx.AsyncClient:
+    '''每个模拟客户端一个连接池，以 address 作为来源地址'''
+    if app:
+        transport = httpx.ASGITransport(app=app, client=(address, 123))
+        return httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=30)
+    transport = httpx.AsyncHTTPTransport(local_address=address)
+    return httpx.AsyncClient(transport=transport, base_url=url, timeout=30)
+
+
+async def crawler(client: httpx.AsyncClient, recorder: Recorder, think: float, latest: int):
+    '''领取任务并提交；被限流没有任务时提交浏览的热门主题'''
+    while True:
+        resp = await call(client, recorder, '/api/topic/task', 'GET')
+        task = resp.json() if resp is not None and resp.status_code == 200 else {}
+        if task.get('sign'):
+            sign, topic = task['sign'], fake_topic(task['id'], task['page'])
+        else:
+            sign, topic = 'undefined', fake_topic(max(1, latest - random.randint(0, HOT_TOPICS)), 1)
+        await call(client, recorder, '/api/topic/info', 'POST', params={'task': sign}, json=topic)
+        await asyncio.sleep(think)
+
+
+async def follow_rank(client: httpx.AsyncClient, recorder: Recorder, resp, params: dict):
+    '''按返回的游标继续翻页，单独统计为 /api/rank?after'''
+    for _ in range(random.randint(0, RANK_PAGES)):
+        after = resp.json()['data']['next'] if resp is not None and resp.status_code == 200 else None
+        if not after:
+            return
+        resp = await call(client, recorder, '/api/rank?after', 'GET', params={**params, 'after': after})
+
+
+async def reader(client: httpx.AsyncClient, recorder: Recorder, think: float):
+    weights = [i[1] for i in READER_ROUTES]
+    while True:
+        route, _, params = random.choices(READER_ROUTES, weights)[0]
+        params = params()
+        resp = await call(client, recorder, route, 'GET', params=params)
+        if route == '/api/rank':
+            await follow_rank(client, recorder, resp, params)
+        await asyncio.sleep(think)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+async def latest_topic_id() -> int:
+    from database import db
+    topic = await db.topic.find_one({}, {'id': 1}, sort=[('id', -1)])
+    return topic['id'] if topic else HOT_TOPICS
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='压测已启动的服务，不指定时进程内调用')
+    parser.add_argument('--crawlers', type=int, default=20, help='爬虫客户端数')
+    parser.add_argument('--readers', type=int, default=50, help='浏览客户端数')
+    parser.add_argument('--think', type=float, default=0, help='每个客户端两次请求间的间隔秒数')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--warmup', type=float, default=5, help='预热秒数，不计入结果')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='结果追加写入的 jsonl 文件')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    app = None
+    if not args.url:
+        from main import app
+        await app.router.startup()
+
+    # 爬虫客户端 127.0.x.x，浏览客户端 127.1.x.x
+    crawlers = [make_client(args.url, app, f'127.0.{i // 256}.{i % 256 + 1}') for i in range(args.crawlers)]
+    readers = [make_client(args.url, app, f'127.1.{i // 256}.{i % 256 + 1}') for i in range(args.readers)]
+
+    recorder = Recorder()
+    latest = await latest_topic_id()
+    workers = [asyncio.create_task(crawler(i, recorder, args.think, latest)) for i in crawlers]
+    workers += [asyncio.create_task(reader(i, recorder, args.think)) for i in readers]
+
+    await asyncio.sleep(args.warmup)
+    recorder.recording = True
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    recorder.recording = False
+    duration = time.perf_counter() - start
+
+    for i in workers:
+        i.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await asyncio.gather(*[i.aclose() for i in crawlers + readers])
+    if app:
+        await app.router.shutdown()
+
+    result = {
+        'commit': git_commit(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'target': args.url or 'asgi',
+        **{i: getattr(args, i) for i in ('crawlers', 'readers', 'think', 'seed')},
+        'duration': round(duration, 1),
+        **recorder.report(duration),
+    }
+    line = json.dumps(result, ensure_ascii=False)
+    print(line)
+    if args.out:
+        with open(args.out, 'a') as f:
+            f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+'''任务调度模拟: 回放任务流，对比按 _id 顺序分配与优先级调度各类任务的等待时间
+
+python -m bench.scheduler_sim [--stream tasks.jsonl] [--rate 2] [--batch 10]
+python -m bench.scheduler_sim --dump tasks.jsonl  # 从数据库导出当前任务流
+
+任务流每行一个 JSON: {"t": 秒, "id": 1, "page": 1, "type": "change",
+"topic": {"date": "...", "spiderTime": "...", "score": 0, "reply": 0}}
+'''
+import statistics
+import datetime
+import argparse
+import asyncio
+import random
+import heapq
+import json
+
+import bench  # noqa: F401 设置测试库
+from scheduler import task_rank, select_with_quota
+
+BASE = datetime.datetime(2024, 1, 1)
+
+
+def synthetic_stream(hours=6):
+    '''每 5 分钟一批 change，每 30 分钟一批 oldest/recent，偶尔 miss 和报错重试'''
+    stream = []
+    topic_id = 1000000
+    for t in range(0, hours * 3600, 300):
+        now = BASE + datetime.timedelta(seconds=t)
+        for _ in range(random.randint(10, 40)):
+            topic_id += 1
+            stream.append({'t': t, 'id': topic_id, 'page': 1, 'type': 'change', 'topic': {
+                'date': now - datetime.timedelta(hours=random.uniform(0, 48)),
+                'spiderTime': now - datetime.timedelta(minutes=random.uniform(5, 300)),
+                'score': random.randint(0, 5000), 'reply': random.randint(0, 200),
+            }})
+        if t % 1800 == 0:
+            for kind, num, days in (('oldest', 1000, 2000), ('recent', 100, 30)):
+                for _ in range(num):
+                    stream.append({'t': t, 'id': random.randint(1, topic_id), 'page': 1, 'type': kind, 'topic': {
+                        'date': now - datetime.timedelta(days=random.uniform(1, days)),
+                        'spiderTime': now - datetime.timedelta(days=random.uniform(0.2, 30)),
+                        'score': random.randint(0, 500), 'reply': random.randint(0, 50),
+                    }})
+        for kind in ('miss', '错误码502'):
+            if random.random() < 0.2:
+                stream.append({'t': t, 'id': random.randint(1, topic_id), 'page': 1, 'type': kind, 'topic': None})
+    return stream
+
+
+def load_stream(path):
+    stream = []
+    with open(path) as f:
+        for line in f:
+            i = json.loads(line)
+            if i.get('topic'):
+                for key in ('date', 'spiderTime'):
+                    if i['topic'].get(key):
+                        i['topic'][key] = datetime.datetime.fromisoformat(i['topic'][key])
+            stream.append(i)
+    return sorted(stream, key=lambda i: i['t'])
+
+
+async def dump_stream(path):
+    '''导出数据库中的任务作为回放任务流'''
+    from database import db
+
+    tasks = await db.task.find({}, ['id', 'page', 'type']).sort('_id', 1).to_list(None)
+    topics = await db.topic.find(
+        {'id': {'$in': list({i['id'] for i in tasks})}},
+        ['id', 'date', 'spiderTime', 'score', 'reply']
+    ).to_list(None)
+    topics = {i.pop('id'): i for i in topics}
+    start = tasks[0]['_id'].generation_time if tasks else None
+    with open(path, 'w') as f:
+        for i in tasks:
+            topic = topics.get(i['id'])
+            if topic:
+                topic.pop('_id', None)
+            f.write(json.dumps({
+                't': (i['_id'].generation_time - start).total_seconds(),
+                'id': i['id'], 'page': i['page'], 'type': i.get('type'),
+                'topic': topic,
+            }, default=str, ensure_ascii=False) + '\n')
+
+
+def simulate(stream, policy, rate, batch):
+    '''每次分配 batch 个任务，平均每秒完成 rate 个，返回各类型的等待时间'''
+    queue = []  # (排序键, 序号, 任务)
+    lags = {}
+    interval = batch / rate
+    now = 0
+    i = 0
+    end = stream[-1]['t'] if stream else 0
+    while i < len(stream) or queue:
+        while i < len(stream) and stream[i]['t'] <= now:
+            task = stream[i]
+            if policy == 'priority':
+                key = task_rank(task['type'], task['topic'], BASE + datetime.timedelta(seconds=task['t']))
+            else:
+                key = i
+            heapq.heappush(queue, (key, i, task))
+            i += 1
+
+        candidates = heapq.nsmallest(batch * 4 if policy == 'priority' else batch, queue)
+        if policy == 'priority':
+            chosen = select_with_quota([{'type': c[2]['type'], 'entry': c} for c in candidates], batch)
+            chosen = [c['entry'] for c in chosen]
+        else:
+            chosen = candidates
+        for entry in chosen:
+            queue.remove(entry)
+            lags.setdefault(entry[2]['type'], []).append(now - entry[2]['t'])
+        heapq.heapify(queue)
+
+        now += interval
+        if now > end * 10 + 86400:
+            break  # 消化不完时停止，剩余任务计为未完成
+    return lags, len(queue)
+
+
+def report(lags):
+    result = {}
+    for kind, values in sorted(lags.items()):
+        values.sort()
+        result[kind] = {
+            'count': len(values),
+            'p50_s': round(statistics.median(values)),
+            'p99_s': round(values[min(len(values) - 1, int(len(values) * 0.99))]),
+            'max_s': round(values[-1]),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', help='回放的任务流文件，默认生成模拟数据')
+    parser.add_argument('--dump', help='从数据库导出任务流到文件')
+    parser.add_argument('--rate', type=float, default=2, help='每秒完成任务数')
+    parser.add_argument('--batch', type=int, default=10, help='每次分配任务数')
+    args = parser.parse_args()
+
+    if args.dump:
+        asyncio.run(dump_stream(args.dump))
+        return
+
+    stream = load_stream(args.stream) if args.stream else synthetic_stream()
+    for policy in ('fifo', 'priority'):
+        lags, left = simulate(stream, policy, args.rate, args.batch)
+        print(json.dumps({'policy': policy, 'unfinished': left, 'lag': report(lags)}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
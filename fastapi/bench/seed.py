@@ -0,0 +1,131 @@
+'''生成模拟 V2EX 数据: 主题、回复、待爬任务，并重建榜单及统计
+
+python -m bench.seed [--topics 1000000] [--replys 3] [--days 1825] [--tasks 20000]
+
+主题 ID 随发布时间递增；得分、感谢数为长尾分布，少数热门内容占据榜首；
+每个主题保存的回复数（有感谢的回复）按指数分布，均值 --replys，不超过主题回复数'''
+import datetime
+import argparse
+import asyncio
+import random
+import time
+import json
+
+import bench  # noqa: F401 设置测试库
+from database import db
+from indexes import ensure_indexes
+from leaderboard import rebuild
+from stats import reconcile
+from tools import new_tasks
+
+NODES = ['qna', 'programmer', 'share', 'create', 'jobs', 'apple', 'python', 'career', 'life', 'cv']
+BATCH = 5000
+
+
+def long_tail(scale: float, alpha: float = 1.5) -> int:
+    return int((random.paretovariate(alpha) - 1) * scale)
+
+
+def html(length: int) -> str:
+    return '<p>' + '内容' * (length // 2) + '</p>'
+
+
+def make_topic(topic_id: int, date: datetime.datetime, now: datetime.datetime) -> dict:
+    reply = long_tail(10)
+    return {
+        'id': topic_id, 'name': f'模拟主题 {topic_id}', 'node': random.choice(NODES),
+        'author': f'user{random.randint(1, 200000)}', 'avatar': 'https://cdn.v2ex.com/avatar/bench.png',
+        'date': date, 'spiderTime': min(date + datetime.timedelta(hours=random.uniform(1, 72)), now),
+        'reply': reply, 'vote': long_tail(1), 'click': long_tail(200), 'collect': long_tail(2),
+        'thank': long_tail(1), 'score': long_tail(300),
+        'content': html(int(random.lognormvariate(6, 1)) % 20000), 'append': [],
+    }
+
+
+def make_replys(topic: dict, reply_id: int, mean: float) -> list:
+    replys = []
+    for _ in range(min(int(random.expovariate(1 / mean)), topic['reply'], 100)):
+        reply_id += 1
+        replys.append({
+            'id': reply_id, 'topicId': topic['id'], 'topicPage': 1,
+            'author': f'user{random.randint(1, 200000)}', 'avatar': 'https://cdn.v2ex.com/avatar/bench.png',
+            'date': topic['date'] + datetime.timedelta(minutes=random.uniform(1, 600)),
+            'spiderTime': topic['spiderTime'], 'thank': long_tail(3) + 1,
+            'content': html(int(random.lognormvariate(4.5, 0.8)) % 5000),
+        })
+    return replys
+
+
+async def seed_corpus(topics: int, replys: float, days: int) -> dict:
+    '''按发布时间顺序分批插入主题及回复'''
+    now = datetime.datetime.now()
+    start = now - datetime.timedelta(days=days)
+    step = datetime.timedelta(days=days) / topics
+    reply_id = 0
+    counts = {'topic': 0, 'reply': 0}
+    for offset in range(0, topics, BATCH):
+        topic_docs, reply_docs = [], []
+        for topic_id in range(offset + 1, min(offset + BATCH, topics) + 1):
+            topic = make_topic(topic_id, start + step * topic_id, now)
+            topic_docs.append(topic)
+            new = make_replys(topic, reply_id, replys)
+            reply_docs += new
+            reply_id += len(new)
+        await asyncio.gather(
+            db.topic.insert_many(topic_docs, ordered=False),
+            db.reply.insert_many(reply_docs, ordered=False) if reply_docs else asyncio.sleep(0),
+        )
+        counts['topic'] += len(topic_docs)
+        counts['reply'] += len(reply_docs)
+        print(f'已生成 {counts["topic"]}/{topics} 个主题', end='\r', flush=True)
+    print()
+    return counts
+
+
+async def seed_tasks(topics: int, tasks: int):
+    '''待爬任务: 近期主题的 change/recent 任务为主，少量 oldest'''
+    now = datetime.datetime.now()
+    recent = max(topics - topics // 100, 1)
+    batch = []
+    for _ in range(tasks):
+        kind = random.choices(['change', 'recent', 'oldest'], [3, 5, 2])[0]
+        topic_id = random.randint(1, topics) if kind == 'oldest' else random.randint(recent, topics)
+        batch.append((topic_id, 1, kind, {
+            'date': now - datetime.timedelta(hours=random.uniform(0, 48)),
+            'spiderTime': now - datetime.timedelta(minutes=random.uniform(5, 600)),
+            'score': long_tail(300), 'reply': long_tail(10),
+        }))
+        if len(batch) >= BATCH:
+            await new_tasks(batch)
+            batch = []
+    await new_tasks(batch)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--topics', type=int, default=1000000)
+    parser.add_argument('--replys', type=float, default=3, help='每个主题平均保存的回复数')
+    parser.add_argument('--days', type=int, default=365 * 5, help='主题发布时间跨度')
+    parser.add_argument('--tasks', type=int, default=20000, help='待爬任务数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数生成相同数据')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    start = time.perf_counter()
+    for name in ('topic', 'reply', 'task', 'leaderboard', 'stats'):
+        await db[name].drop()
+    counts = await seed_corpus(args.topics, args.replys, args.days)
+    # 先插入后建索引，比逐条维护索引快
+    await ensure_indexes()
+    await seed_tasks(args.topics, args.tasks)
+    today = datetime.date.today()
+    await rebuild(today - datetime.timedelta(days=args.days), today)
+    await reconcile()
+    print(json.dumps({
+        **vars(args), **counts,
+        'seconds': round(time.perf_counter() - start, 1),
+    }))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+'''序列化开销对比: 一个带 100 条回复的主题
+
+python -m bench.serialize [--number 2000]
+'''
+from fastapi.encoders import jsonable_encoder
+import datetime
+import argparse
+import timeit
+import json
+
+from model import Topic
+from fastjson import dumps
+
+
+def sample_topic(replys=100) -> dict:
+    now = datetime.datetime.now()
+    return {
+        'spiderTime': now, 'id': 1, 'name': '标题' * 10, 'node': 'qna',
+        'author': 'bench', 'avatar': 'https://cdn.v2ex.com/avatar.png', 'date': now,
+        'reply': replys, 'vote': 1, 'click': 1000, 'collect': 10, 'thank': 5, 'score': 3000,
+        'content': '<p>正文</p>' * 200, 'append': ['<p>附言</p>'] * 2,
+        'replys': [{
+            'spiderTime': now, 'topicId': 1, 'topicPage': 1, 'id': i,
+            'author': 'bench', 'avatar': 'https://cdn.v2ex.com/avatar.png',
+            'date': now, 'thank': i, 'content': '回复内容' * 20,
+        } for i in range(replys)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    doc = sample_topic()
+    blob = dumps(Topic(**doc))
+    cases = {
+        # FastAPI 默认: response_model 校验 + jsonable_encoder + 标准库 json
+        'validate+stdlib': lambda: json.dumps(jsonable_encoder(Topic(**doc))).encode(),
+        # 快速模式: 入库时已校验，直接 orjson
+        'orjson': lambda: dumps(doc),
+        # 预序列化: 只需拼接
+        'preserialised': lambda: b'[' + b','.join([blob]) + b']',
+    }
+    result = {}
+    for name, func in cases.items():
+        seconds = timeit.timeit(func, number=args.number)
+        result[name] = {'us_per_request': round(seconds / args.number * 1e6, 1)}
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from starlette.requests import Request
+from starlette.responses import Response
+from functools import wraps
+import inspect
+import asyncio
+import time
+import sys
+
+
+CACHES = {}
+
+
+class ResponseCache:
+    '''带过期时间的 LRU 缓存，限制条目数及总字节数'''
+
+    def __init__(self, name, expiration_time=60, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.name = name
+        self.expiration_time = expiration_time
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (result, expires, size)
+        self.pending = {}  # key -> Task，同一个 key 并发未命中时只请求一次
+        self.bytes = 0
+        self.sweeper = None
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'expirations': 0}
+
+    @classmethod
+    def sizeof(cls, result, seen=None):
+        '''递归估算占用字节数，sys.getsizeof 只计算外层对象'''
+        if isinstance(result, Response):
+            return len(result.body)
+        seen = set() if seen is None else seen
+        if id(result) in seen:
+            return 0
+        seen.add(id(result))
+        size = sys.getsizeof(result)
+        if isinstance(result, dict):
+            size += sum(cls.sizeof(k, seen) + cls.sizeof(v, seen) for k, v in result.items())
+        elif isinstance(result, (list, tuple, set, frozenset)):
+            size += sum(cls.sizeof(i, seen) for i in result)
+        elif hasattr(result, '__dict__'):
+            size += cls.sizeof(vars(result), seen)
+        return size
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self.remove(key)
+            self.stats['expirations'] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, result):
+        if key in self.entries:
+            self.remove(key)
+        size = self.sizeof(result)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (result, time.monotonic() + self.expiration_time, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+
+    def remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def sweep(self):
+        '''清理过期数据'''
+        now = time.monotonic()
+        for key in [k for k, v in self.entries.items() if v[1] <= now]:
+            self.remove(key)
+            self.stats['expirations'] += 1
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(min(max(self.expiration_time, 1), 60))
+            self.sweep()
+
+    async def get_or_compute(self, key, func):
+        entry = self.get(key)
+        if entry is not None:
+            self.stats['hits'] += 1
+            return entry[0]
+
+        # 同一个 key 正在计算，等待同一个结果
+        if key in self.pending:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self.pending[key])
+
+        self.stats['misses'] += 1
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.create_task(self.sweep_forever())
+
+        # 在独立的 task 中计算，首个请求被取消时不影响其他等待者
+        task = asyncio.create_task(self.fill(key, func))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 无人等待时避免未获取异常的警告
+        self.pending[key] = task
+        return await asyncio.shield(task)
+
+    async def fill(self, key, func):
+        try:
+            result = await func()
+            self.set(key, result)
+            return result
+        finally:
+            del self.pending[key]
+
+    def info(self):
+        return {
+            **self.stats,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def cache(expiration_time=60, max_entries=256, max_bytes=32 * 1024 * 1024, vary_query=(), vary_headers=()):
+    '''接口响应缓存
+
+    缓存 key 由绑定后的参数组成（忽略 Request），
+    vary_query / vary_headers 指定的请求参数及请求头也会加入 key'''
+
+    def wrapper(func):
+        signature = inspect.signature(func)
+        store = ResponseCache(func.__name__, expiration_time, max_entries, max_bytes)
+        CACHES[func.__name__] = store
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = []
+            for name, value in bound.arguments.items():
+                if isinstance(value, Request):
+                    key += [('q:' + i, value.query_params.get(i)) for i in vary_query]
+                    key += [('h:' + i, value.headers.get(i)) for i in vary_headers]
+                else:
+                    key.append((name, repr(value)))
+            return tuple(key)
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            key = make_key(args, kwargs)
+            return await store.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        inner.cache = store
+        return inner
+    return wrapper
+
+
+def cache_stats():
+    '''所有缓存的命中、未命中及淘汰统计'''
+    return {name: store.info() for name, store in CACHES.items()}
@@ -0,0 +1,185 @@
+import traceback
+import datetime
+import asyncio
+import random
+import time
+
+from database import db
+
+TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+# 字段取值范围: 分 时 日 月 周（0 和 7 都是周日）
+FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def parse_field(expr: str, low: int, high: int) -> set:
+    values = set()
+    for part in expr.split(','):
+        part, slash, step = part.partition('/')
+        step = int(step) if slash else 1
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = int(part)
+            # 与标准 cron 一致: N/step 表示从 N 到最大值每隔 step
+            end = high if slash else start
+        if start < low or end > high or step < 1:
+            raise ValueError(f'cron 字段超出范围: {expr}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    '''五段式 cron 表达式，按 UTC+8 计算'''
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f'cron 表达式需要 5 段: {expr}')
+        self.expr = expr
+        self.minute, self.hour, self.day, self.month, self.weekday = [
+            parse_field(p, *r) for p, r in zip(parts, FIELDS)
+        ]
+        if 7 in self.weekday:
+            self.weekday.add(0)
+        # 与标准 cron 一致: 以 * 开头（含 */step）视为不限定
+        self.any_day = parts[2].startswith('*')
+        self.any_weekday = parts[4].startswith('*')
+
+    def match(self, dt: datetime.datetime) -> bool:
+        if dt.minute not in self.minute or dt.hour not in self.hour or dt.month not in self.month:
+            return False
+        day = dt.day in self.day
+        weekday = (dt.isoweekday() % 7) in self.weekday
+        # 与标准 cron 一致: 日和周都限定时满足其一即可
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after: datetime.datetime) -> datetime.datetime:
+        '''after 之后的下一次触发时间'''
+        dt = after.astimezone(TZ).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        for _ in range(366 * 24 * 60):
+            if self.match(dt):
+                return dt
+            dt += datetime.timedelta(minutes=1)
+        raise ValueError(f'cron 表达式一年内不会触发: {self.expr}')
+
+    def prev(self, before: datetime.datetime, limit: datetime.timedelta) -> datetime.datetime:
+        '''before 之前 limit 时间内最近的一次触发时间，没有则返回 None'''
+        dt = before.astimezone(TZ).replace(second=0, microsecond=0)
+        end = dt - limit
+        while dt > end:
+            if self.match(dt):
+                return dt
+            dt -= datetime.timedelta(minutes=1)
+        return None
+
+
+class Job:
+    '''定时任务，支持固定间隔或 cron、随机抖动、超时、运行中跳过及错过补跑'''
+
+    def __init__(self, func, interval: float = None, cron: str = None, jitter: float = 0,
+                 timeout: float = None, catch_up: float = 0):
+        if (interval is None) == (cron is None):
+            raise ValueError('interval 和 cron 需要且只能指定一个')
+        self.func = func
+        self.name = func.__name__
+        self.interval = interval
+        self.cron = Cron(cron) if cron else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.catch_up = catch_up
+        self.running = None
+        self.schedule = cron or f'every {interval}s'
+
+    def next_run(self, now: datetime.datetime) -> datetime.datetime:
+        if self.cron:
+            next_run = self.cron.next(now)
+        else:
+            next_run = now + datetime.timedelta(seconds=self.interval)
+        return next_run + datetime.timedelta(seconds=random.uniform(0, self.jitter))
+
+    async def execute(self):
+        # 开始时即记录 last_start，运行中发生切主时新 leader 不会重复补跑
+        start = time.monotonic()
+        await self.save(
+            {'runs': 1, 'success': 0, 'failure': 0, 'timeout': 0, 'skipped': 0, 'total_duration': 0},
+            {'schedule': self.schedule, 'last_start': datetime.datetime.now(TZ)},
+        )
+        inc, state = {}, {'last_error': None}
+        try:
+            await asyncio.wait_for(self.func(), self.timeout)
+            inc['success'] = 1
+        except asyncio.TimeoutError:
+            inc.update(timeout=1, failure=1)
+            state['last_error'] = f'超时 {self.timeout}s'
+            print(f'{self.name} 超时')
+        except Exception as e:
+            inc['failure'] = 1
+            state['last_error'] = repr(e)
+            print('='*20)
+            print(self.name)
+            print(e)
+            traceback.print_exc()
+            print('='*20)
+        finally:
+            duration = time.monotonic() - start
+            inc['total_duration'] = duration
+            state.update(last_end=datetime.datetime.now(TZ), last_duration=round(duration, 3))
+            await self.save(inc, state)
+
+    def fire(self):
+        '''运行任务，上一次尚未结束时跳过'''
+        if self.running and not self.running.done():
+            print(f'{self.name} 上次运行未结束，跳过')
+            asyncio.create_task(self.save({'skipped': 1}))
+            return
+        self.running = asyncio.create_task(self.execute())
+
+    async def save(self, inc: dict, state: dict = None):
+        '''计数用 $inc 累加，重启或切主后不会清零'''
+        update = {'$inc': inc}
+        if state:
+            update['$set'] = state
+        try:
+            await db.job.update_one({'_id': self.name}, update, upsert=True)
+        except Exception as e:
+            print(f'{self.name} 运行记录保存失败', e)
+
+    async def missed(self, now: datetime.datetime) -> bool:
+        '''catch_up 时间内是否有错过的 cron 触发'''
+        if not (self.cron and self.catch_up):
+            return False
+        scheduled = self.cron.prev(now, datetime.timedelta(seconds=self.catch_up))
+        if scheduled is None:
+            return False
+        record = await db.job.find_one({'_id': self.name}, {'last_start': 1})
+        last_start = record and record.get('last_start')
+        if last_start and last_start.tzinfo is None:
+            last_start = last_start.replace(tzinfo=datetime.timezone.utc)
+        return last_start is None or last_start < scheduled
+
+    async def run_forever(self):
+        now = datetime.datetime.now(TZ)
+        # 固定间隔任务启动时立即运行一次，cron 任务只在错过时补跑
+        if self.interval is not None or await self.missed(now):
+            self.fire()
+        try:
+            while True:
+                next_run = self.next_run(datetime.datetime.now(TZ))
+                await asyncio.sleep(max((next_run - datetime.datetime.now(TZ)).total_seconds(), 0))
+                self.fire()
+        finally:
+            if self.running:
+                self.running.cancel()
+
+
+async def job_stats() -> list:
+    '''各定时任务的运行统计（leader 进程写入数据库，各 worker 均可读取）'''
+    jobs = await db.job.find().sort('_id', 1).to_list(None)
+    for i in jobs:
+        i['avg_duration'] = round(i['total_duration'] / i['runs'], 3) if i.get('runs') else None
+    return jobs
@@ -1,4 +1,10 @@
 import motor.motor_asyncio
+import os
 
-client = motor.motor_asyncio.AsyncIOMotorClient('mongodb://mongo')
-db = client.V2EX
\ No newline at end of file
+from metrics import MongoCommandListener
+
+client = motor.motor_asyncio.AsyncIOMotorClient(
+    os.environ.get('MONGO_URL', 'mongodb://mongo'),
+    event_listeners=[MongoCommandListener()],
+)
+db = client[os.environ.get('MONGO_DB', 'V2EX')]
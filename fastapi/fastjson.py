@@ -0,0 +1,39 @@
+from fastapi.responses import Response
+from pydantic import BaseModel
+from bson import ObjectId
+import orjson
+import os
+
+# FAST_JSON=1 开启: 接口跳过 response_model 的出参校验，直接用 orjson 序列化
+FAST_JSON = os.environ.get('FAST_JSON') == '1'
+
+
+def default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError
+
+
+def dumps(obj) -> bytes:
+    '''时间格式与 FastAPI 默认的 isoformat 一致，不带时区的时间不加后缀'''
+    return orjson.dumps(obj, default=default)
+
+
+class FastJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content  # 已预先序列化
+        return dumps(content)
+
+
+def json_response(data):
+    '''快速模式下直接返回序列化后的响应，否则交给 FastAPI 按 response_model 处理
+
+    数据在入库时已经校验过，出参无需再次校验'''
+    if FAST_JSON:
+        return FastJSONResponse(data)
+    return data
@@ -0,0 +1,21 @@
+# 生产环境: gunicorn -c gunicorn.conf.py main:app
+# 定时任务由 leader.py 选主，只会在一个 worker 中运行
+#
+# 以下状态保存在各 worker 进程内，不在 worker 间共享:
+# - 任务限流 task_limiter: 补充速度按 worker 数均分，总体约为设定值；积攒上限按 worker 计，保证单次批量租用
+# - 写入缓冲 ingest_buffer: 条目上限按 worker 计，总内存约为 workers 倍
+# - 响应缓存、推荐池、样式表: 各自刷新，短时间内各 worker 内容可能不同
+# - /metrics 计数: 只包含处理本次抓取的 worker，需要全局数据时在 Prometheus 中按实例汇总，
+#   或设置 WEB_CONCURRENCY=1
+# 需要全局一致的计数（首页统计）保存在 Mongo 的 stats 文档中
+import multiprocessing
+import os
+
+bind = '0.0.0.0:8000'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# worker 进程继承环境变量，据此均分进程内的限流额度
+os.environ['WEB_CONCURRENCY'] = str(workers)
+keepalive = 5
+timeout = 60
+graceful_timeout = 30
@@ -0,0 +1,104 @@
+import hashlib
+import asyncio
+import aiohttp
+import random
+import os
+
+# 便于用本地模拟服务测试
+V2EX_URL = os.environ.get('V2EX_URL', 'https://www.v2ex.com')
+TG_URL = os.environ.get('TG_URL', 'https://api.telegram.org')
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 只有幂等请求默认重试，POST 重试可能重复提交（如重复发送 Telegram 消息）
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class HttpClient:
+    '''应用共享的 HTTP 客户端，复用连接池
+
+    cookie 不在会话间共享，需要时按请求传入'''
+
+    def __init__(self, limit=100, limit_per_host=10, timeout=30, retries=3, backoff=0.5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=10)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self.validators = {}  # url -> (etag, last_modified, body_hash)
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError('HttpClient 未启动')
+        return self._session
+
+    async def fetch(self, method: str, url: str, retries: int = None, **kwargs) -> aiohttp.ClientResponse:
+        '''发送请求并读取响应体，网络错误及 5xx 时指数退避重试
+
+        返回时连接已释放，响应体保存在 resp.body，不能再调用 resp.read()；
+        非幂等请求默认不重试，需要时显式传入 retries'''
+        if self._session is None:
+            await self.start()
+        if retries is None:
+            retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    resp.body = await resp.read()
+                    if resp.status not in RETRY_STATUS or attempt == retries:
+                        return resp
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def fetch_if_changed(self, url: str, **kwargs):
+        '''条件请求，内容未变化（304 或内容哈希相同）时返回 None，否则返回响应文本'''
+        etag, last_modified, body_hash = self.validators.get(url, (None, None, None))
+        headers = dict(kwargs.pop('headers', None) or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        resp = await self.fetch('GET', url, headers=headers, **kwargs)
+        if resp.status == 304:
+            return None
+        resp.raise_for_status()
+
+        new_hash = hashlib.sha1(resp.body).hexdigest()
+        self.validators[url] = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'), new_hash)
+        if new_hash == body_hash:
+            return None
+        return await resp.text()
+
+
+def response_cookies(resp: aiohttp.ClientResponse) -> dict:
+    '''合并重定向链上所有响应设置的 cookie'''
+    cookies = {}
+    for r in (*resp.history, resp):
+        cookies.update({k: v.value for k, v in r.cookies.items()})
+    return cookies
+
+
+http = HttpClient()
@@ -0,0 +1,118 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+import datetime
+import asyncio
+
+from database import db
+
+
+# 索引注册表: 集合 -> 索引列表，新增查询时在此声明所需索引
+INDEXES = {
+    'topic': [
+        IndexModel([('id', ASCENDING)], name='id', unique=True),
+        IndexModel([('date', ASCENDING), ('score', DESCENDING)], name='date_score'),
+        IndexModel([('spiderTime', ASCENDING)], name='spiderTime'),
+    ],
+    'reply': [
+        IndexModel([('id', ASCENDING)], name='id', unique=True),
+        IndexModel([('date', ASCENDING), ('thank', DESCENDING)], name='date_thank'),
+    ],
+    'task': [
+        IndexModel([('id', ASCENDING), ('page', ASCENDING)], name='id_page', unique=True),
+        IndexModel([('distribute_time', ASCENDING), ('_id', ASCENDING)], name='distribute_time_id'),
+        IndexModel([('rank', ASCENDING), ('_id', ASCENDING)], name='rank_id'),
+        IndexModel([('complete_time', ASCENDING)], name='complete_time'),
+        IndexModel([('lease_expire', ASCENDING)], name='lease_expire'),
+        IndexModel([('lease', ASCENDING)], name='lease', sparse=True),
+    ],
+    'error': [
+        IndexModel([('code', ASCENDING), ('topic_id', ASCENDING), ('page', ASCENDING)], name='code_topic_page'),
+        IndexModel([('topic_id', ASCENDING), ('page', ASCENDING), ('time', ASCENDING)], name='topic_page_time'),
+    ],
+    'leaderboard': [
+        IndexModel([('kind', ASCENDING), ('period', ASCENDING)], name='kind_period', unique=True),
+    ],
+    'weekly': [
+        IndexModel([('title', ASCENDING)], name='title'),
+    ],
+}
+
+
+def query_shapes():
+    '''需要走索引的热点查询: (集合, 过滤条件, 排序)'''
+    now = datetime.datetime.now()
+    day = now - datetime.timedelta(days=1)
+    return [
+        # home / rank / generate_weekly / recommend
+        ('leaderboard', {'kind': 'topic', 'period': {'$in': ['2024-01-01', '2024-01']}}, None),
+        # 榜单重建
+        ('topic', {'date': {'$gte': day, '$lt': now}}, [('score', -1)]),
+        ('reply', {'date': {'$gte': day, '$lt': now}}, [('thank', -1)]),
+        # generate_task
+        ('topic', {'spiderTime': {'$lte': now}}, [('spiderTime', 1)]),
+        # topic_change / topic_info
+        ('topic', {'id': 1}, None),
+        ('reply', {'id': 1}, None),
+        # get_task / delete_task
+        ('task', {'distribute_time': None}, [('_id', 1)]),
+        ('task', {'complete_time': None}, [('rank', 1), ('_id', 1)]),
+        ('task', {'lease_expire': {'$lte': now}}, None),
+        ('task', {'lease': ''}, None),
+        ('task', {'distribute_time': {'$lte': now}, 'complete_time': None}, None),
+        ('task', {'complete_time': {'$ne': None}}, None),
+        ('task', {'id': 1, 'page': 1}, None),
+    ]
+
+
+async def ensure_indexes():
+    '''对比已有索引，创建缺失的索引'''
+    for name, indexes in INDEXES.items():
+        collection = db[name]
+        existing = await collection.index_information()
+        missing = [i for i in indexes if i.document['name'] not in existing]
+        for index in missing:
+            try:
+                await collection.create_indexes([index])
+                print(f'创建索引 {name}.{index.document["name"]}')
+            except OperationFailure as e:
+                # 唯一索引遇到历史重复数据时会失败，需要人工清理
+                print(f'创建索引失败 {name}.{index.document["name"]}: {e}')
+
+        declared = {i.document['name'] for i in indexes} | {'_id_'}
+        for i in set(existing) - declared:
+            print(f'未声明的索引 {name}.{i}')
+
+
+def _stages(plan):
+    '''遍历执行计划中的所有 stage'''
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+
+async def check_query_plans():
+    '''explain 所有注册的查询，存在全表扫描则抛出异常'''
+    collscans = []
+    for name, filter, sort in query_shapes():
+        cursor = db[name].find(filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.limit(1).explain()
+        winning = plan['queryPlanner']['winningPlan']
+        if 'COLLSCAN' in _stages(winning):
+            collscans.append((name, filter, sort))
+
+    if collscans:
+        raise AssertionError('以下查询未命中索引: %s' % collscans)
+
+
+if __name__ == '__main__':
+    async def main():
+        await ensure_indexes()
+        await check_query_plans()
+        print('所有查询均命中索引')
+
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from tools import save_topics
+from leaderboard import update_leaderboard
+from metrics import ingest_buffer_items, ingest_buffer_flush, ingest_coalesced, ingest_rejected
+
+
+def newer(doc: dict, current: dict) -> bool:
+    '''按 spiderTime 判断是否比已缓冲的文档更新，相同时后到者胜出'''
+    try:
+        return doc['spiderTime'] >= current['spiderTime']
+    except TypeError:  # 客户端混用带时区与不带时区的时间
+        return True
+
+
+class IngestBuffer:
+    '''写后缓冲: 提交立即返回，按 id 合并后批量写入 Mongo
+
+    条目数达到 batch_size 或距上次写入超过 interval 秒时写入一批；
+    缓冲条目数达到 max_items 时拒绝新提交，由接口返回 429。
+    缓冲只在内存中，进程崩溃或被强制结束时会丢失尚未写入的提交（通常不超过 interval 秒），
+    客户端之后重新提交或由定时任务重新爬取'''
+
+    def __init__(self, batch_size: int = 500, interval: float = 1, max_items: int = 10000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_items = max_items
+        self.topics = {}
+        self.replys = {}
+        self.tasks = set()
+        # 已入库但榜单尚未更新的文档，下次写入时只重试榜单
+        self.unranked = {'topic': {}, 'reply': {}}
+        self.wakeup = asyncio.Event()
+        self.flushing = asyncio.Lock()
+        self.runner = None
+        self.closed = False
+
+    def __len__(self):
+        return len(self.topics) + len(self.replys)
+
+    def pending(self) -> bool:
+        return bool(len(self) or self.tasks or any(self.unranked.values()))
+
+    def merge(self, buffer: dict, kind: str, docs: list):
+        for doc in docs:
+            current = buffer.get(doc['id'])
+            if current is not None:
+                ingest_coalesced.inc(kind=kind)
+                if not newer(doc, current):
+                    continue
+            buffer[doc['id']] = doc
+
+    def put(self, topics: list, replys: list, tasks: list) -> bool:
+        '''加入缓冲，缓冲已满时返回 False'''
+        if len(self) >= self.max_items:
+            ingest_rejected.inc()
+            return False
+        self.merge(self.topics, 'topic', topics)
+        self.merge(self.replys, 'reply', replys)
+        self.tasks.update(tasks)
+        self.update_gauge()
+        if len(self) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def update_gauge(self):
+        ingest_buffer_items.set(len(self.topics), kind='topic')
+        ingest_buffer_items.set(len(self.replys), kind='reply')
+
+    def restore(self, topics: dict, replys: dict, tasks: set):
+        '''写入失败时放回缓冲，不覆盖期间到达的更新数据'''
+        self.merge(self.topics, 'topic', [i for i in topics.values() if i['id'] not in self.topics])
+        self.merge(self.replys, 'reply', [i for i in replys.values() if i['id'] not in self.replys])
+        self.tasks.update(tasks)
+        self.update_gauge()
+
+    async def flush(self):
+        '''写入当前缓冲的全部内容并更新榜单，失败时保留失败的步骤等待下次重试'''
+        async with self.flushing:
+            if not self.pending():
+                return
+            topics, replys, tasks = self.topics, self.replys, self.tasks
+            self.topics, self.replys, self.tasks = {}, {}, set()
+            self.update_gauge()
+
+            start = time.perf_counter()
+            if topics or replys or tasks:
+                try:
+                    changed = await save_topics(list(topics.values()), list(replys.values()), list(tasks))
+                except asyncio.CancelledError:
+                    self.restore(topics, replys, tasks)
+                    raise
+                except Exception as e:
+                    print('写入缓冲失败', e)
+                    self.restore(topics, replys, tasks)
+                    ingest_buffer_flush.observe(time.perf_counter() - start, result='error')
+                    return
+                for kind, docs in changed.items():
+                    self.unranked[kind].update({i['id']: i for i in docs})
+
+            try:
+                await asyncio.gather(*[
+                    update_leaderboard(kind, list(docs.values())) for kind, docs in self.unranked.items()
+                ])
+            except Exception as e:
+                # 数据已入库，不再重复写入，只保留待更新榜单的文档
+                print('更新榜单失败', e)
+                ingest_buffer_flush.observe(time.perf_counter() - start, result='error')
+                return
+            self.unranked = {'topic': {}, 'reply': {}}
+            ingest_buffer_flush.observe(time.perf_counter() - start, result='ok')
+
+    async def run(self):
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.runner = asyncio.create_task(self.run())
+
+    async def drain(self):
+        if self.runner:
+            await self.runner
+        while self.pending():
+            await self.flush()
+            if self.pending():
+                await asyncio.sleep(self.interval)
+
+    async def close(self, timeout: float = 10):
+        '''停止后台写入并写入剩余内容，超过 timeout 秒仍未写完时放弃并记录丢失的条数'''
+        self.closed = True
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            print(f'写入缓冲关闭超时，丢失 {len(self.topics)} 个主题、{len(self.replys)} 个回复、'
+                  f'{len(self.tasks)} 个任务，{sum(map(len, self.unranked.values()))} 个文档未更新榜单')
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,74 @@
+from pymongo.errors import DuplicateKeyError
+import datetime
+import asyncio
+import socket
+import uuid
+import os
+
+from database import db
+
+
+class LeaderLease:
+    '''基于 Mongo 的租约选主，多个进程/容器中只有一个持有租约
+
+    持有者每 ttl/3 秒续约，超过 ttl 秒未续约时其他进程接管'''
+
+    def __init__(self, name: str, ttl: int = 30):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+
+    async def try_acquire(self) -> bool:
+        '''获取或续约，返回当前是否为 leader'''
+        now = datetime.datetime.now()
+        try:
+            await db.lock.update_one({
+                '_id': self.name,
+                '$or': [
+                    {'owner': self.owner},
+                    {'expire': {'$lte': now}},
+                ]
+            }, {
+                '$set': {
+                    'owner': self.owner,
+                    'expire': now + datetime.timedelta(seconds=self.ttl),
+                    'heartbeat': now,
+                }
+            }, upsert=True)
+            self.is_leader = True
+        except DuplicateKeyError:
+            # 租约被其他进程持有且未过期
+            self.is_leader = False
+        return self.is_leader
+
+    async def release(self):
+        if self.is_leader:
+            self.is_leader = False
+            await db.lock.update_one(
+                {'_id': self.name, 'owner': self.owner},
+                {'$set': {'expire': datetime.datetime.now()}}
+            )
+
+    async def run(self, on_elected, on_demoted):
+        '''持续竞选，成为 leader 及失去 leader 时分别调用 on_elected / on_demoted'''
+        leading = False
+        while True:
+            try:
+                await self.try_acquire()
+            except Exception as e:
+                # 无法连接数据库时无法确认租约，主动退位
+                print('续约失败', e)
+                self.is_leader = False
+
+            if self.is_leader and not leading:
+                print(f'{self.owner} 成为 {self.name} leader')
+                await on_elected()
+            elif not self.is_leader and leading:
+                print(f'{self.owner} 失去 {self.name} leader')
+                await on_demoted()
+            leading = self.is_leader
+            await asyncio.sleep(self.ttl / 3)
+
+
+leader = LeaderLease('bg_task')
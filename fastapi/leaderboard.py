@@ -0,0 +1,210 @@
+from pymongo import UpdateOne
+import datetime
+import itertools
+import asyncio
+import heapq
+
+from database import db
+from tools import localtime, TOPIC_LIST_FIELDS, REPLY_LIST_FIELDS
+
+# 每天/每月保留的条数
+TOP_K = 100
+
+KINDS = {
+    'topic': ('score', TOPIC_LIST_FIELDS),
+    'reply': ('thank', REPLY_LIST_FIELDS),
+}
+
+LOCAL_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+
+def order(kind):
+    '''榜单排序: 分数降序，同分按 id 降序，保证分页游标稳定'''
+    key, _ = KINDS[kind]
+    return lambda i: (-i[key], -i['id'])
+
+
+def periods(date):
+    '''文档所属的日榜及月榜（UTC+8）'''
+    date = localtime(date)
+    return [f'{date:%Y-%m-%d}', f'{date:%Y-%m}']
+
+
+def item(kind, doc):
+    _, fields = KINDS[kind]
+    return {i: doc[i] for i in fields if i in doc}
+
+
+async def update_leaderboard(kind: str, docs: list):
+    '''入库时增量更新榜单，只有可能进入前 K 的文档才会写入'''
+    key, _ = KINDS[kind]
+    docs = list({i['id']: i for i in docs if i.get('date')}.values())
+    if not docs:
+        return
+
+    touched = {p for i in docs for p in periods(i['date'])}
+    boards = await db.leaderboard.find(
+        {'kind': kind, 'period': {'$in': list(touched)}},
+        {'period': 1, 'items.id': 1, f'items.{key}': 1}
+    ).to_list(None)
+    boards = {i['period']: i['items'] for i in boards}
+
+    ops = []
+    for period in touched - set(boards):
+        ops.append(UpdateOne(
+            {'kind': kind, 'period': period},
+            {'$setOnInsert': {'items': []}},
+            upsert=True
+        ))
+    for doc in docs:
+        for period in periods(doc['date']):
+            items = boards.get(period, [])
+            floor = items[-1] if len(items) >= TOP_K else None
+            listed = any(i['id'] == doc['id'] for i in items)
+            if not listed and floor is not None and (doc[key], doc['id']) <= (floor[key], floor['id']):
+                continue
+            if listed:
+                ops.append(UpdateOne(
+                    {'kind': kind, 'period': period},
+                    {'$pull': {'items': {'id': doc['id']}}}
+                ))
+            # 多个 worker 可能同时认为文档未上榜，过滤条件保证不会重复加入
+            ops.append(UpdateOne(
+                {'kind': kind, 'period': period, 'items.id': {'$ne': doc['id']}},
+                {'$push': {'items': {
+                    '$each': [item(kind, doc)],
+                    '$sort': {key: -1, 'id': -1},
+                    '$slice': TOP_K,
+                }}, '$inc': {'version': 1}}
+            ))
+    if ops:
+        # 有序执行，保证先建文档、先 pull 再 push
+        await db.leaderboard.bulk_write(ops, ordered=True)
+
+
+async def rebuild_day(kind: str, day: datetime.date):
+    '''从原始数据重建某天的日榜'''
+    key, fields = KINDS[kind]
+    start = datetime.datetime(day.year, day.month, day.day, tzinfo=LOCAL_TZ)
+    docs = await db[kind].find(
+        {'date': {'$gte': start, '$lt': start + datetime.timedelta(days=1)}}, fields
+    ).sort([(key, -1), ('id', -1)]).limit(TOP_K).to_list(TOP_K)
+    await db.leaderboard.update_one(
+        {'kind': kind, 'period': f'{day:%Y-%m-%d}'},
+        {'$set': {'items': [item(kind, i) for i in docs]}, '$inc': {'version': 1}},
+        upsert=True
+    )
+
+
+async def rebuild_month(kind: str, year: int, month: int):
+    '''由日榜合并出月榜'''
+    key, _ = KINDS[kind]
+    days = await db.leaderboard.find(
+        {'kind': kind, 'period': {'$regex': f'^{year:04d}-{month:02d}-'}}
+    ).to_list(None)
+    items = list(itertools.islice(
+        heapq.merge(*[i['items'] for i in days], key=order(kind)), TOP_K
+    ))
+    await db.leaderboard.update_one(
+        {'kind': kind, 'period': f'{year:04d}-{month:02d}'},
+        {'$set': {'items': items}, '$inc': {'version': 1}},
+        upsert=True
+    )
+
+
+async def rebuild(start: datetime.date, end: datetime.date):
+    '''重建 [start, end] 的日榜及涉及的月榜'''
+    months = set()
+    day = start
+    while day <= end:
+        for kind in KINDS:
+            await rebuild_day(kind, day)
+        months.add((day.year, day.month))
+        day += datetime.timedelta(days=1)
+    for year, month in sorted(months):
+        for kind in KINDS:
+            await rebuild_month(kind, year, month)
+
+
+def window_periods(start: datetime.datetime, end: datetime.datetime) -> list:
+    '''将 [start, end) 拆成尽量少的整月及零散日期'''
+    start = localtime(start).date()
+    end = localtime(end)
+    # end 不在零点时当天也要算上
+    end = end.date() + datetime.timedelta(days=1) if end.time() != datetime.time(0) else end.date()
+
+    result = []
+    day = start
+    while day < end:
+        next_month = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        if day.day == 1 and next_month <= end:
+            result.append(f'{day:%Y-%m}')
+            day = next_month
+        else:
+            result.append(f'{day:%Y-%m-%d}')
+            day += datetime.timedelta(days=1)
+    return result
+
+
+async def top(kind: str, start: datetime.datetime, end: datetime.datetime, limit: int = TOP_K) -> list:
+    '''时间窗口内排名前 limit 的文档，由各期榜单多路归并得到'''
+    key, _ = KINDS[kind]
+    boards = await db.leaderboard.find(
+        {'kind': kind, 'period': {'$in': window_periods(start, end)}},
+        {'items': {'$slice': limit}}
+    ).to_list(None)
+    return list(itertools.islice(
+        heapq.merge(*[i['items'] for i in boards], key=order(kind)), limit
+    ))
+
+
+async def versions(kind: str, start: datetime.datetime, end: datetime.datetime) -> tuple:
+    '''时间窗口内各期榜单的版本号，榜单写入时递增，用于判断缓存的内容是否过期'''
+    boards = await db.leaderboard.find(
+        {'kind': kind, 'period': {'$in': window_periods(start, end)}},
+        {'period': 1, 'version': 1}
+    ).to_list(None)
+    return tuple(sorted((i['period'], i.get('version', 0)) for i in boards))
+
+
+def cursor(kind: str, doc: dict) -> str:
+    key, _ = KINDS[kind]
+    return f'{doc[key]}_{doc["id"]}'
+
+
+def parse_cursor(after: str) -> tuple:
+    '''解析 "分数_id" 游标，格式错误时抛出 ValueError'''
+    score, id = after.split('_')
+    return int(score), int(id)
+
+
+async def page(kind: str, start: datetime.datetime, end: datetime.datetime, after: str = None, limit: int = 50):
+    '''按 (分数, id) 游标分页，返回 (列表, 下一页游标)
+
+    每一页都从同一窗口的榜单合并结果中截取，最多翻到前 TOP_K 条；
+    游标格式错误时抛出 ValueError'''
+    key, _ = KINDS[kind]
+    bound = parse_cursor(after) if after else None
+    items = await top(kind, start, end, TOP_K)
+    if bound:
+        items = [i for i in items if (i[key], i['id']) < bound]
+    return items[:limit], cursor(kind, items[limit - 1]) if len(items) > limit else None
+
+
+async def top_by_day(kind: str, days: list, limit: int = 3) -> list:
+    '''多个日期（距今天数）各自前 limit 的文档，按 days 顺序返回'''
+    today = localtime(datetime.datetime.now()).date()
+    periods = [f'{today - datetime.timedelta(days=i):%Y-%m-%d}' for i in days]
+    boards = await db.leaderboard.find(
+        {'kind': kind, 'period': {'$in': periods}},
+        {'period': 1, 'items': {'$slice': limit}}
+    ).to_list(None)
+    boards = {i['period']: i['items'] for i in boards}
+    return [i for p in periods for i in boards.get(p, [])]
+
+
+if __name__ == '__main__':
+    # 全量回填: python leaderboard.py [开始日期]
+    import sys
+    start = datetime.date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else datetime.date(2010, 4, 25)
+    asyncio.run(rebuild(start, localtime(datetime.datetime.now()).date()))
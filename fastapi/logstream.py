@@ -0,0 +1,157 @@
+from collections import deque
+import threading
+import asyncio
+import docker
+import os
+
+
+class DockerLogSource:
+    '''在独立线程中读取容器日志，一个容器只占用一个 Docker 连接'''
+
+    def __init__(self, name: str, tail: int = 100):
+        self.name = name
+        self.tail = tail
+
+    async def lines(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        streams = []
+        stopped = threading.Event()
+
+        def read():
+            try:
+                client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
+                for container in client.containers.list():
+                    if self.name in container.name:
+                        stream = container.logs(stream=True, follow=True, tail=self.tail)
+                        streams.append(stream)
+                        # 打开日志流前读取方可能已经取消，此时 finally 中看不到这个流
+                        if stopped.is_set():
+                            stream.close()
+                            break
+                        for line in stream:
+                            if stopped.is_set():
+                                break
+                            loop.call_soon_threadsafe(queue.put_nowait, line)
+                        break
+            finally:
+                if not stopped.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        threading.Thread(target=read, daemon=True).start()
+        try:
+            while True:
+                line = await queue.get()
+                if line is None:
+                    return
+                yield line
+        finally:
+            # 关闭日志流让读取线程退出
+            stopped.set()
+            for stream in streams:
+                stream.close()
+
+
+class FakeLogSource:
+    '''本地测试用日志源，按固定间隔产生日志'''
+
+    def __init__(self, name: str, interval: float = 1):
+        self.name = name
+        self.interval = interval
+
+    async def lines(self):
+        n = 0
+        while True:
+            n += 1
+            yield f'{self.name} log line {n}\n'.encode()
+            await asyncio.sleep(self.interval)
+
+
+class LogChannel:
+    '''单个容器的日志广播: 一个读取任务写入环形缓冲并分发给所有订阅者'''
+
+    def __init__(self, source, buffer_size: int, queue_size: int, idle_timeout: float):
+        self.source = source
+        self.buffer = deque(maxlen=buffer_size)
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.subscribers = set()
+        self.reader = None
+        self.idle_handle = None
+
+    async def read(self):
+        try:
+            async for line in self.source.lines():
+                self.buffer.append(line)
+                for queue in self.subscribers:
+                    if queue.full():
+                        # 消费过慢的订阅者丢弃最旧的日志
+                        queue.get_nowait()
+                    queue.put_nowait(line)
+        finally:
+            for queue in self.subscribers:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        for line in list(self.buffer)[-self.queue_size:]:
+            queue.put_nowait(line)
+        self.subscribers.add(queue)
+        if self.idle_handle:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.create_task(self.read())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.idle_handle is None:
+            self.idle_handle = asyncio.get_running_loop().call_later(self.idle_timeout, self.stop_if_idle)
+
+    def stop_if_idle(self):
+        self.idle_handle = None
+        if not self.subscribers and self.reader:
+            self.reader.cancel()
+            self.reader = None
+            self.buffer.clear()
+
+
+class LogHub:
+    '''日志订阅中心，没有订阅者超过 idle_timeout 秒的读取任务会被关闭'''
+
+    def __init__(self, source_factory, buffer_size: int = 1000, queue_size: int = 1000, idle_timeout: float = 60):
+        self.source_factory = source_factory
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.channels = {}
+
+    def channel(self, name: str) -> LogChannel:
+        if name not in self.channels:
+            self.channels[name] = LogChannel(
+                self.source_factory(name), self.buffer_size, self.queue_size, self.idle_timeout
+            )
+        return self.channels[name]
+
+    async def stream(self, name: str, sse: bool = False):
+        '''订阅日志，sse 为 True 时按 text/event-stream 格式输出'''
+        channel = self.channel(name)
+        queue = channel.subscribe()
+        try:
+            while True:
+                line = await queue.get()
+                if line is None:
+                    return
+                if sse:
+                    text = line.decode(errors='replace').rstrip('\n')
+                    yield ''.join(f'data: {i}\n' for i in text.split('\n')) + '\n'
+                else:
+                    yield line
+        finally:
+            channel.unsubscribe(queue)
+
+
+log_hub = LogHub(FakeLogSource if os.environ.get('LOG_SOURCE') == 'fake' else DockerLogSource)
@@ -1,20 +1,37 @@
-from fastapi import FastAPI, Request, Header
+from fastapi import FastAPI, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from bson import ObjectId
-from typing import List
-import markdown
+from typing import List, Literal
+import ipaddress
+import hashlib
+import hmac
+import os
 import datetime
 import asyncio
 import random
-import docker
 
 from task import run_task
-from tools import localtime, dt_format, remove_tag_a, cache, new_task, get_task, complete_task, get_login_info, login_get_a2, generate_weekly
+from leader import leader
+from cron import job_stats
+from stats import incr, get_stats, refresh_queue_depth
+from metrics import LatencyMiddleware, ingest_topics, ingest_replys, render as render_metrics
+from indexes import ensure_indexes
+from cache import cache, cache_stats
+from httpclient import http
+from logstream import log_hub
+from recommend import topic_pool, reply_pool, refresh_pools
+from styles import style_table, refresh_styles
+from fastjson import json_response, dumps, FAST_JSON
+from tools import localtime, dt_format, remove_tag_a, parse_error, http_date, not_modified, get_task, split_replys, lease_tasks, renew_tasks, ack_tasks, get_login_info, login_get_a2
+from weekly import generate_weekly, ensure_rendered
+from leaderboard import top_by_day, page
+from ingestbuffer import ingest_buffer
 from database import db
-from model import SuccessResponse, Reply, Topic, Task, ErrorReport
+from model import SuccessResponse, Reply, Topic, TopicSubmission, Task, TaskLease, LeaseUpdate, ErrorReport
 
 
 app = FastAPI(
@@ -32,6 +49,22 @@ app = FastAPI(
         "url": "https://www.gnu.org/licenses/gpl-3.0.en.html",
     },)
 
+class GZipExcept:
+    '''除 exclude 中的路径外启用 GZip，SSE 日志流压缩后会被缓冲，无法实时推送'''
+
+    def __init__(self, app, exclude=(), **kwargs):
+        self.app = app
+        self.gzip = GZipMiddleware(app, **kwargs)
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in self.exclude:
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
+
+
+app.add_middleware(GZipExcept, exclude=['/logs'], minimum_size=1000)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -39,6 +72,8 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True
 )
+app.add_middleware(LatencyMiddleware)
+
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -51,9 +86,22 @@ templates.env.filters["remove_tag_a"] = remove_tag_a
 # 在应用程序启动之前运行的函数
 @app.on_event("startup")
 async def startup_event():
+    print('创建索引')
+    asyncio.create_task(ensure_indexes())
+    await http.start()
+    ingest_buffer.start()
+    asyncio.create_task(refresh_pools())
+    asyncio.create_task(refresh_styles())
     print('启动定时任务')
     asyncio.create_task(run_task())
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingest_buffer.close()
+    await leader.release()
+    await http.close()
+
             
 @app.get("/", response_class=HTMLResponse)
 @cache(10)
@@ -64,70 +112,37 @@ async def home(request: Request):
     for i in range(10):
         days.append(random.randint(8,365*3))
 
-    topics = []
-    # 每天前三的主题且得分高于 8000 分
-    for i in days:
-        day = datetime.datetime.now() - datetime.timedelta(days=i)
-        topics += (await db.topic.find({
-            "date": {
-                "$gte": day.replace(hour=0, minute=0, second=0),
-                "$lt": day.replace(hour=23, minute=59, second=59)
-            }
-        }).sort("score", -1).limit(3).to_list(3))
-    
-    replys = []
-    # 每天前三的回复
-    for i in days:
-        day = datetime.datetime.now() - datetime.timedelta(days=i)
-        replys += (await db.reply.find({
-            "date": {
-                "$gte": day.replace(hour=0, minute=0, second=0),
-                "$lt": day.replace(hour=23, minute=59, second=59)
-            }
-        }).sort("thank", -1).limit(3).to_list(3))
+    # 每天前三的主题及回复，从日榜读取
+    topics, replys = await asyncio.gather(
+        top_by_day('topic', days),
+        top_by_day('reply', days),
+    )
 
+    stats, jobs = await asyncio.gather(get_stats(), job_stats())
     data = {
         'request': request,
         'topics': topics,
         'replys': replys,
-        # 主题总数
-        # 'topic_total': await db.topic.count_documents({}),
-        # 近一月超三天未爬取主题数
-        'topic_recent_total': await db.topic.count_documents({
-            'date': {'$gte': datetime.datetime.now() - datetime.timedelta(days=30)},
-            'spiderTime': {'$lte': datetime.datetime.now() - datetime.timedelta(days=3)}
-        }),
-        # 超两周未爬取主题数
-        'topic_recent_2w_total': await db.topic.count_documents({
-            'spiderTime': {'$lte': datetime.datetime.now() - datetime.timedelta(days=14)}
-        }),
-        'latest_topic_id': (await db.topic.find_one(sort=[('id', -1)]))['id'],
+        'topic_recent_total': stats.get('topic_recent_total', 0),
+        'topic_recent_2w_total': stats.get('topic_recent_2w_total', 0),
+        'latest_topic_id': stats.get('latest_topic_id', 0),
         # 任务总数
-        'task_total': await db.task.count_documents({}),
+        'task_total': stats.get('task_total', 0),
         # 未分配任务总数
-        'task_not_distribute_total': await db.task.count_documents({'distribute_time': None}),
+        'task_not_distribute_total': stats.get('task_pending', 0),
         # 未完成任务总数
-        'task_not_complete_total': await db.task.count_documents({'complete_time': None}),
+        'task_not_complete_total': stats.get('task_not_complete', 0),
         # 分配后未完成任务总数
-        'task_distribute_but_not_complete_total': await db.task.count_documents({
-            'distribute_time': {'$lte': datetime.datetime.now() - datetime.timedelta(seconds=60)},
-            'complete_time': None
-        }),
-        # 待处理错误数
-        'error_total': await db.error.count_documents({}),
+        'task_distribute_but_not_complete_total': stats.get('task_not_complete', 0) - stats.get('task_pending', 0),
+        'error_total': stats.get('error_total', 0),
+        'jobs': jobs,
     }
 
     return templates.TemplateResponse("index.html", data)
 
             
-@app.get("/rank", response_class=HTMLResponse)
-async def rank(request: Request, start: str = None, end: str = None):
-    '''排行榜'''
-
-    now = localtime(datetime.datetime.now())
-    recent_30_days = now - datetime.timedelta(days=30)
-    recent_90_days = now - datetime.timedelta(days=90)
-    recent_365_days = now - datetime.timedelta(days=365)
+def rank_window(start: str = None, end: str = None):
+    '''解析排行榜时间范围，默认为全部'''
     try:
         start = localtime(datetime.datetime.strptime(start, '%Y-%m-%d'))
     except:
@@ -135,22 +150,24 @@ async def rank(request: Request, start: str = None, end: str = None):
     try:
         end = localtime(datetime.datetime.strptime(end, '%Y-%m-%d'))
     except:
-        end = now
+        end = localtime(datetime.datetime.now())
+    return start, end
 
 
-    topics = await db.topic.find({
-        "date": {
-            "$gte": start,
-            "$lt": end
-        }
-    }).sort("score", -1).limit(100).to_list(100)
-    
-    replys = await db.reply.find({
-        "date": {
-            "$gte": start,
-            "$lt": end
-        }
-    }).sort("thank", -1).limit(100).to_list(100)
+@app.get("/rank", response_class=HTMLResponse)
+async def rank(request: Request, start: str = None, end: str = None):
+    '''排行榜'''
+
+    now = localtime(datetime.datetime.now())
+    recent_30_days = now - datetime.timedelta(days=30)
+    recent_90_days = now - datetime.timedelta(days=90)
+    recent_365_days = now - datetime.timedelta(days=365)
+    start, end = rank_window(start, end)
+
+    (topics, topic_next), (replys, reply_next) = await asyncio.gather(
+        page('topic', start, end),
+        page('reply', start, end),
+    )
 
     data = {
         'request': request,
@@ -161,11 +178,25 @@ async def rank(request: Request, start: str = None, end: str = None):
         'recent_365_days': recent_365_days,
         'topics': topics,
         'replys': replys,
+        'topic_next': topic_next,
+        'reply_next': reply_next,
     }
 
     return templates.TemplateResponse("rank.html", data)
 
 
+@app.get("/api/rank", response_model=SuccessResponse)
+async def rank_api(kind: Literal['topic', 'reply'] = 'topic', start: str = None, end: str = None,
+                   after: str = None, limit: int = Query(50, ge=1, le=100)) -> SuccessResponse:
+    '''排行榜分页，after 为上一页返回的 next 游标'''
+    start, end = rank_window(start, end)
+    try:
+        items, next_cursor = await page(kind, start, end, after, limit)
+    except ValueError:
+        return Response(status_code=400)
+    return json_response(SuccessResponse(data={'items': items, 'next': next_cursor}))
+
+
 @app.get("/weekly/md", response_class=HTMLResponse)
 async def weekly(request: Request):
 
@@ -182,13 +213,15 @@ async def weekly(request: Request):
 
 
 @app.get("/weekly", response_class=HTMLResponse)
-async def weekly(request: Request):
+async def weekly(request: Request, before: str = None):
 
-    weeklys = await db.weekly.find().sort('_id', -1).limit(10).to_list(10)
+    filter = {'_id': {'$lt': ObjectId(before)}} if before and ObjectId.is_valid(before) else {}
+    weeklys = await db.weekly.find(filter, {'title': 1, 'date': 1}).sort('_id', -1).limit(10).to_list(10)
     
     data = {
         'request': request,
-        'weeklys': weeklys
+        'weeklys': weeklys,
+        'next': weeklys[-1]['_id'] if len(weeklys) == 10 else None,
     }
     return templates.TemplateResponse("weeklyList.html", data)
 
@@ -196,11 +229,9 @@ async def weekly(request: Request):
 @app.get("/weekly/detail/{weekly_id}", response_class=HTMLResponse)
 async def weekly(weekly_id: str, request: Request):
 
-    weekly = await db.weekly.find_one({'_id': ObjectId(weekly_id)})
-    content = markdown.markdown(weekly['content'])
-    user_agent = request.headers.get("User-Agent")
-    if "Mobile" in user_agent:
-        content = content.replace('&emsp;', '')
+    weekly = await ensure_rendered(await db.weekly.find_one({'_id': ObjectId(weekly_id)}))
+    user_agent = request.headers.get("User-Agent", '')
+    content = weekly['html_mobile'] if "Mobile" in user_agent else weekly['html']
     data = {
         'request': request,
         'weekly': weekly,
@@ -209,19 +240,37 @@ async def weekly(weekly_id: str, request: Request):
     return templates.TemplateResponse("weeklyDetail.html", data)
 
 
+# 最新一期周报 _id -> (内容, ETag, Last-Modified)
+atom_cache = {}
+
+
 @app.get("/weekly/atom.xml", response_class=HTMLResponse)
 async def weekly_atom(request: Request):
 
-    today = localtime(datetime.datetime.now()).replace(hour=0, minute=0, second=0)
-    weeklys = await db.weekly.find().sort('_id', -1).limit(10).to_list(10)
-    for i in weeklys:
-        i['content'] = markdown.markdown(i['content'])
-    data = {
-        'request': request,
-        'updated': datetime.datetime.today().strftime('%Y-%m-%dT%H:%M:%SZ'),
-        'weeklys': weeklys
+    latest = await db.weekly.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    key = latest and latest['_id']
+    if key not in atom_cache:
+        weeklys = await db.weekly.find({}, {'html_mobile': 0}).sort('_id', -1).limit(10).to_list(10)
+        for i in weeklys:
+            i['content'] = (await ensure_rendered(i))['html']
+        updated = weeklys[0]['date'] if weeklys else datetime.datetime(2023, 1, 1)
+        body = templates.get_template("weekly.xml").render({
+            'request': request,
+            'updated': updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'weeklys': weeklys
+        }).encode()
+        atom_cache.clear()
+        atom_cache[key] = (body, '"%s"' % hashlib.sha1(body).hexdigest(), updated)
+
+    body, etag, updated = atom_cache[key]
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(updated),
+        'Cache-Control': 'public, max-age=3600',
     }
-    return templates.TemplateResponse("weekly.xml", data, media_type="application/atom+xml; charset=UTF-8")
+    if not_modified(request.headers, etag, updated):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/atom+xml; charset=UTF-8", headers=headers)
 
 
 @app.get("/a2", response_class=HTMLResponse)
@@ -250,87 +299,208 @@ async def post_a2(captcha: str, pwd: str, once: str, session: str, u: str, p: st
             
 @app.get("/store", response_class=HTMLResponse)
 async def store(request: Request):
-    styles = await db.style.find().limit(100).to_list(100)
+    styles = await db.style.find({}, {'css': 0}).limit(100).to_list(100)
+    for i in styles:
+        # 引用带内容哈希的地址，尚未加载到内存表的样式使用固定地址
+        asset = style_table.assets.get(i['github'])
+        i['href'] = f'/style/{i["github"]}.{asset.hash}.css' if asset else f'/style/{i["github"]}'
     data = {
         'request': request,
         'styles': styles
     }
     return templates.TemplateResponse("store.html", data)
 
+
+def style_response(request: Request, asset, cache_control: str) -> Response:
+    headers = {
+        'ETag': asset.etag,
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+    if not_modified(request.headers, asset.etag):
+        return Response(status_code=304, headers=headers)
+    encoding, body = asset.negotiate(request.headers.get('Accept-Encoding'))
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, media_type="text/css", headers=headers)
+
+
+@app.get("/style/{style_name}.{style_hash}.css", response_class=HTMLResponse)
+async def style_immutable(request: Request, style_name: str, style_hash: str):
+    '''带内容哈希的样式地址，可永久缓存'''
+    asset = await style_table.get(style_name)
+    if not asset:
+        return Response(status_code=404)
+    if asset.hash != style_hash:
+        return RedirectResponse(f'/style/{style_name}.{asset.hash}.css')
+    return style_response(request, asset, 'public, max-age=31536000, immutable')
+
+
 @app.get("/style/{style_name}", response_class=HTMLResponse)
-@cache(3600)
-async def style(style_name):
-        
-    style = await db.style.find_one({'github': style_name})
-    return HTMLResponse(style['css'], media_type="text/css")
+async def style(request: Request, style_name: str):
+    '''样式地址固定，内容更新后通过 ETag 重新验证'''
+    asset = await style_table.get(style_name)
+    if not asset:
+        return Response(status_code=404)
+    return style_response(request, asset, 'public, max-age=3600')
+
+
+# 可信反向代理的地址或网段，逗号分隔（如 127.0.0.1,172.17.0.0/16）；
+# 只有对端是可信代理时才读取 X-Forwarded-For，默认不信任，直接对外服务时保持为空
+TRUSTED_PROXIES = [ipaddress.ip_network(i.strip()) for i in os.environ.get('TRUSTED_PROXIES', '').split(',') if i.strip()]
+
+
+def trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in i for i in TRUSTED_PROXIES)
+
+
+def client_id(request: Request) -> str:
+    '''客户端标识，从对端地址开始沿 X-Forwarded-For 从右向左跳过可信代理
+
+    X-Forwarded-For 靠前的部分由客户端自己填写，不能用于限流'''
+    host = request.client.host if request.client else ''
+    forwarded = [i.strip() for i in request.headers.get('X-Forwarded-For', '').split(',') if i.strip()]
+    while forwarded and trusted_proxy(host):
+        host = forwarded.pop()
+    return host
 
 
 @app.get("/api/topic/recommend", response_model=List[Topic])
 async def topic_recommend() -> List[Topic]:
     '''推荐主题'''
-    topics = await db.topic.find({
-        'date': {
-            '$gte': datetime.datetime.now() - datetime.timedelta(days=7)
-        }
-    }).sort("score", -1).limit(50).to_list(100)
-    topics = random.sample(list(topics), 10)
-    return list(map(dict, topics))
+    if topic_pool.updated is None:
+        await topic_pool.refresh()
+    return topic_pool.response()
 
 
 @app.get("/api/reply/recommend", response_model=List[Reply])
-async def topic_recommend() -> List[Reply]:
+async def reply_recommend() -> List[Reply]:
     '''推荐回复'''
-    replys = await db.reply.find({
-        'date': {
-            '$gte': datetime.datetime.now() - datetime.timedelta(days=7)
-        }
-    }).sort("thank", -1).limit(50).to_list(100)
-    replys = random.sample(list(replys), 10)
-    for i in replys:
-        i['content'] = remove_tag_a(i['content'])
-    return list(map(dict, replys))
+    if reply_pool.updated is None:
+        await reply_pool.refresh()
+    return reply_pool.response()
+
+
+def ingest(topics: list, tasks: list) -> bool:
+    '''提交的主题及回复放入写入缓冲，缓冲已满时返回 False'''
+    topics = [i.dict() for i in topics]
+    replys = split_replys(topics)
+    if not ingest_buffer.put(topics, replys, tasks):
+        return False
+    ingest_topics.inc(len(topics))
+    ingest_replys.inc(len(replys))
+    return True
+
+
+# 最常见的成功响应，预先序列化
+OK = dumps(SuccessResponse()) if FAST_JSON else SuccessResponse()
+
+
+def busy() -> Response:
+    '''写入缓冲已满，客户端稍后重试'''
+    return Response(status_code=429, headers={'Retry-After': '5'})
 
 
 @app.post("/api/topic/info", response_model=SuccessResponse)
-async def topic_info(task: str, topic: Topic) -> SuccessResponse:
+async def topic_info(request: Request, task: str, topic: Topic) -> SuccessResponse:
     '''提交主题信息'''
-    topic = topic.dict()
-    replys = topic.pop('replys')
-    await db.topic.update_one({'id': topic['id']}, {"$set": topic}, upsert=True)
-    # TEMP 临时排除浏览状态提交的回复（其他插件影响内容）
-    for i in replys:
-        if '<div class="show-reply">' in i['content']:
-            continue
-        if '的这条回复发送感谢' in i['content']:
-            continue
-        await db.reply.find_one_and_update({'id': i['id']}, {"$set": i}, upsert=True)
-    if (task != 'undefined'):
-        await complete_task(task)
-    return SuccessResponse()
+    if not ingest([topic], [task]):
+        return busy()
+    return json_response(OK)
+
+
+@app.post("/api/topic/info/batch", response_model=SuccessResponse)
+async def topic_info_batch(request: Request, submissions: List[TopicSubmission]) -> SuccessResponse:
+    '''批量提交主题信息（多个主题或同一主题的多页）'''
+    if not ingest([i.topic for i in submissions], [i.task for i in submissions]):
+        return busy()
+    return json_response(OK)
 
 
 @app.get("/api/topic/task", response_model=Task, include_in_schema=False)
-async def topic_task() -> Task:
+async def topic_task(request: Request) -> Task:
     '''获取爬取任务'''
     # return Task(sign='',id=0,page=1,url='')
 
-    return await get_task()
+    return json_response(await get_task(client_id(request)))
+
+
+@app.get("/api/topic/tasks", response_model=TaskLease, include_in_schema=False)
+async def topic_tasks(request: Request, n: int = 10) -> TaskLease:
+    '''批量租用爬取任务'''
+    return json_response(await lease_tasks(client_id(request), n))
+
+
+@app.post("/api/topic/tasks/renew", response_model=SuccessResponse, include_in_schema=False)
+async def topic_tasks_renew(update: LeaseUpdate) -> SuccessResponse:
+    '''任务续租'''
+    return json_response(SuccessResponse(data=await renew_tasks(update.lease, update.signs)))
+
+
+@app.post("/api/topic/tasks/ack", response_model=SuccessResponse, include_in_schema=False)
+async def topic_tasks_ack(update: LeaseUpdate) -> SuccessResponse:
+    '''批量完成任务'''
+    return json_response(SuccessResponse(data=await ack_tasks(update.lease, update.signs)))
 
 
 @app.post("/api/error/info", response_model=SuccessResponse, include_in_schema=False)
 async def error_info(error: ErrorReport) -> SuccessResponse:
     '''错误上报'''
-    await db.error.insert_one(error.dict())
-    return SuccessResponse()
+    error = error.dict()
+    await db.error.insert_one({**error, **parse_error(error['url'], error['error'])})
+    await incr(error_total=1)
+    return json_response(OK)
+
+
+# /metrics、/jobs、/cache 的访问令牌（Authorization: Bearer <令牌>），未设置时只允许内网访问；
+# 内网地址按 client_id 判断，前面有反向代理时须把代理加入 TRUSTED_PROXIES，否则所有请求都来自代理的内网地址
+INTERNAL_TOKEN = os.environ.get('INTERNAL_TOKEN')
+
+
+def internal(request: Request) -> bool:
+    '''内部接口鉴权，不信任非可信代理发来的 X-Forwarded-For'''
+    if INTERNAL_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {INTERNAL_TOKEN}')
+    try:
+        return ipaddress.ip_address(client_id(request)).is_private
+    except ValueError:
+        return False
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    '''Prometheus 格式的监控指标（单个 worker 进程内的数据）'''
+    if not internal(request):
+        return Response(status_code=403)
+    await refresh_queue_depth()
+    return Response(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.get("/jobs", include_in_schema=False)
+async def jobs(request: Request):
+    '''定时任务运行统计'''
+    if not internal(request):
+        return Response(status_code=403)
+    return await job_stats()
+
+
+@app.get("/cache", include_in_schema=False)
+async def cache_info(request: Request):
+    '''缓存命中统计'''
+    if not internal(request):
+        return Response(status_code=403)
+    return cache_stats()
 
 
 @app.get("/logs", response_class=StreamingResponse)
-async def logs():
-    '''请求日志'''
-
-    client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
-    for container in client.containers.list():
-        if 'fastapi' in container.name:
-            log_stream = container.logs(stream=True, follow=True, tail=100)
-            return StreamingResponse(log_stream, media_type="text/plain")
-    return None
+async def logs(request: Request):
+    '''请求日志，Accept: text/event-stream 时以 SSE 推送'''
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    return StreamingResponse(
+        log_hub.stream('fastapi', sse),
+        media_type='text/event-stream' if sse else 'text/plain'
+    )
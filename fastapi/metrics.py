@@ -0,0 +1,158 @@
+'''Prometheus 文本格式指标
+
+指标保存在进程内，gunicorn 多 worker 时每次抓取只反映其中一个 worker'''
+from pymongo import monitoring
+import threading
+import time
+
+# 单个标签最多的取值数，超出后归入 other，避免标签取值无限增长
+MAX_LABEL_VALUES = 1000
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()  # Mongo 监听回调在 Motor 的线程池中执行
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        key = tuple(str(labels.get(i, '')) for i in self.labels)
+        if key not in self.values and len(self.values) >= MAX_LABEL_VALUES:
+            key = tuple('other' for _ in self.labels)
+        return key
+
+    def format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in pairs)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name + self.format_labels(key), value
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(str(labels.get(i, '')) for i in self.labels), 0)
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            lines += [f'{name} {value}' for name, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        with self.lock:
+            key = self.key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        with self.lock:
+            key = self.key(labels)
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0, 0]
+            counts, _, _ = entry = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            for bound, n in zip(self.buckets, counts):
+                yield self.name + '_bucket' + self.format_labels(key, {'le': bound}), n
+            yield self.name + '_bucket' + self.format_labels(key, {'le': '+Inf'}), count
+            yield self.name + '_sum' + self.format_labels(key), total
+            yield self.name + '_count' + self.format_labels(key), count
+
+
+REGISTRY = []
+
+http_latency = Histogram('http_request_duration_seconds', '接口响应耗时', ('method', 'route', 'status'))
+mongo_latency = Histogram('mongo_command_duration_seconds', 'Mongo 命令耗时', ('command', 'status'))
+queue_depth = Gauge('task_queue_depth', '各类型、各状态的爬虫任务数', ('type', 'state'))
+ingest_topics = Counter('ingest_topics_total', '提交的主题数')
+ingest_replys = Counter('ingest_replys_total', '提交的回复数')
+ingest_writes = Counter('ingest_writes_total', '入库写入类型: new 新增, changed 部分字段变化, touch 仅更新爬取时间', ('kind', 'result'))
+ingest_skip_ratio = Gauge('ingest_skip_ratio', '入库时内容及计数均无变化的比例', ('kind',))
+ingest_buffer_items = Gauge('ingest_buffer_items', '写入缓冲中等待写入的条目数', ('kind',))
+ingest_buffer_flush = Histogram('ingest_buffer_flush_seconds', '写入缓冲每批写入耗时', ('result',))
+ingest_coalesced = Counter('ingest_coalesced_total', '在写入缓冲中被合并的重复提交', ('kind',))
+ingest_rejected = Counter('ingest_rejected_total', '写入缓冲已满被拒绝的提交')
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    '''记录每个 Mongo 命令的耗时'''
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_latency.observe(event.duration_micros / 1e6, command=event.command_name, status='ok')
+
+    def failed(self, event):
+        mongo_latency.observe(event.duration_micros / 1e6, command=event.command_name, status='error')
+
+
+class LatencyMiddleware:
+    '''按路由记录接口耗时
+
+    纯 ASGI 中间件，不像 BaseHTTPMiddleware 那样经过额外的 task 和队列转发响应体'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # 路由匹配后 starlette 会把 route 写入同一个 scope
+            route = scope.get('route')
+            http_latency.observe(
+                time.perf_counter() - start,
+                method=scope['method'],
+                route=route.path if route else 'unmatched',
+                status=status,
+            )
+
+
+def render() -> str:
+    return '\n'.join(i.render() for i in REGISTRY) + '\n'
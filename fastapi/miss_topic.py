@@ -1,23 +1,54 @@
+from array import array
 import asyncio
+
 from database import db
+from tools import new_tasks
+
+# 之前已经遍历过一次了，从 90 万开始
+START_ID = 900000
+BATCH = 10000
+# 单次最多生成的任务数，超过时下次从断点继续
+MAX_TASKS = 5000
+
+
+def find_gaps(prev: int, ids: array) -> list:
+    '''prev 为上一块最后一个 id，返回 ids 中缺失的 id'''
+    missing = []
+    for i in ids:
+        if i > prev + 1:
+            missing.extend(range(prev + 1, i))
+        prev = i
+    return missing
+
 
-# 按顺序遍历 id 找出缺失的主题
-async def check_id():
-    # 已经遍历过一次了，后面只需要从 92 万开始
-    cursor = db.topic.find({'id': {'get': 900000}}, {'id': 1}).sort('id', 1)
-    prev_index = None
+async def check_missing_topics():
+    '''找出缺失的主题并生成爬取任务，只扫描上次高水位之后的 id'''
+    state = await db.state.find_one({'_id': 'miss_topic'})
+    hwm = state['id'] if state else START_ID
+
+    # 只取 id 字段，由 id 唯一索引直接覆盖，无需读取文档
+    cursor = db.topic.find({'id': {'$gt': hwm}}, {'id': 1, '_id': 0}).sort('id', 1).batch_size(BATCH)
+    missing = []
+    ids = array('q')
     async for document in cursor:
-        index = document.get('id')
-        if prev_index is not None and index != prev_index + 1:
-            for missing_index in range(prev_index + 1, index):
-                print(f'遗漏主题: {missing_index}')
-                await db.task.insert_one({
-                    'id': missing_index,
-                    'page': 1,
-                    'distribute_time': None,
-                    'complete_time': None,
-                    'type': 'miss',
-                })
-        prev_index = index
-
-asyncio.run(check_id())
+        ids.append(document['id'])
+        if len(ids) < BATCH:
+            continue
+        missing += find_gaps(hwm, ids)
+        hwm = ids[-1]
+        ids = array('q')
+        if len(missing) >= MAX_TASKS:
+            break
+    else:
+        if ids:
+            missing += find_gaps(hwm, ids)
+            hwm = ids[-1]
+
+    if missing:
+        print(f'遗漏主题 {len(missing)} 个: {missing[0]} ~ {missing[-1]}')
+        await new_tasks((i, 1, 'miss') for i in missing)
+    await db.state.update_one({'_id': 'miss_topic'}, {'$set': {'id': hwm}}, upsert=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(check_missing_topics())
@@ -7,7 +7,7 @@ from datetime import datetime
 class SuccessResponse(BaseModel):
     code: int = Field(description='响应状态码', default=0)
     msg: str = Field(description='状态码说明', default='ok')
-    data: Any = Field(description='数据')
+    data: Any = Field(description='数据', default=None)
 
 
 class Reply(BaseModel):
@@ -42,6 +42,11 @@ class Topic(BaseModel):
     replys: Union[List[Reply], None] = Field(description='获赞回复')
 
 
+class TopicSubmission(BaseModel):
+    task: str = Field(description='任务 ID', default='undefined')
+    topic: Topic = Field(description='主题信息')
+
+
 class Task(BaseModel):
     sign: str = Field(description='任务 ID')
     id: int = Field(description='主题 ID')
@@ -49,6 +54,17 @@ class Task(BaseModel):
     url: str = Field(description='爬取地址')
 
 
+class TaskLease(BaseModel):
+    lease: str = Field(description='租约 ID')
+    expire: datetime = Field(description='租约过期时间')
+    tasks: List[Task] = Field(description='任务列表')
+
+
+class LeaseUpdate(BaseModel):
+    lease: str = Field(description='租约 ID')
+    signs: List[str] = Field(description='任务 ID 列表')
+
+
 class ErrorReport(BaseModel):
     type: Literal['read', 'task'] = Field(description='错误类型')
     url: str = Field(description='错误地址')
@@ -0,0 +1,85 @@
+import itertools
+import datetime
+import asyncio
+import random
+import math
+
+from database import db
+from leaderboard import top
+from tools import remove_tag_a
+from model import Topic, Reply
+from fastjson import FastJSONResponse, dumps, FAST_JSON
+
+
+class RecommendPool:
+    '''推荐候选池: 定时从榜单取近 7 天前 size 条，预先清洗并校验
+
+    请求时按分数加权随机抽取，不访问数据库；FAST_JSON 时还预先序列化'''
+
+    def __init__(self, kind: str, model, key: str, size: int = 50, days: int = 7):
+        self.kind = kind
+        self.model = model
+        self.key = key
+        self.size = size
+        self.days = days
+        self.items = []  # 校验后的模型
+        self.encoded = []  # 序列化后的 JSON，仅 FAST_JSON 时使用
+        self.cum_weights = []
+        self.updated = None
+
+    def prepare(self, doc: dict) -> dict:
+        if self.kind == 'reply':
+            doc['content'] = remove_tag_a(doc['content'])
+        return doc
+
+    async def refresh(self):
+        now = datetime.datetime.now()
+        ranked = await top(self.kind, now - datetime.timedelta(days=self.days), now, self.size)
+        docs = await db[self.kind].find({'id': {'$in': [i['id'] for i in ranked]}}, {'_id': 0}).to_list(None)
+        docs = sorted(docs, key=lambda i: -i[self.key])
+
+        items, weights = [], []
+        for doc in docs:
+            try:
+                items.append(self.model(**self.prepare(doc)))
+            except ValueError as e:
+                print(f'推荐{self.kind} {doc.get("id")} 数据异常', e)
+                continue
+            # 开方弱化头部，分数高的更容易被抽到但不会垄断
+            weights.append(math.sqrt(max(doc[self.key], 0)) + 1)
+
+        self.items = items
+        self.encoded = [dumps(i) for i in items] if FAST_JSON else []
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.updated = now
+
+    def sample(self, k: int = 10) -> list:
+        '''加权不重复抽取 k 个下标，候选不足 k 个时全部返回'''
+        if len(self.items) <= k:
+            return list(range(len(self.items)))
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(random.choices(range(len(self.items)), cum_weights=self.cum_weights, k=k - len(chosen)))
+        return list(chosen)
+
+    def response(self, k: int = 10):
+        '''FAST_JSON 时直接拼接预先序列化的 JSON，否则交给 FastAPI 按 response_model 处理'''
+        chosen = self.sample(k)
+        if FAST_JSON:
+            return FastJSONResponse(b'[' + b','.join(self.encoded[i] for i in chosen) + b']')
+        return [self.items[i] for i in chosen]
+
+
+topic_pool = RecommendPool('topic', Topic, 'score')
+reply_pool = RecommendPool('reply', Reply, 'thank')
+
+
+async def refresh_pools(interval: int = 60):
+    '''每个 worker 进程各自定时刷新推荐池'''
+    while True:
+        for pool in (topic_pool, reply_pool):
+            try:
+                await pool.refresh()
+            except Exception as e:
+                print(f'刷新推荐{pool.kind}失败', e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,71 @@
+import datetime
+import math
+
+
+# 各类任务的优先提前量（分钟），未列出的为报错重试任务
+TYPE_BOOST = {
+    'change': 60,
+    'recent': 20,
+    'miss': 10,
+    'oldest': 0,
+}
+RETRY_BOOST = 5
+
+# 单次分配中各类任务最多占比，保证低优先级任务也能分到
+TYPE_QUOTA = {
+    'change': 0.6,
+    'recent': 0.3,
+    'oldest': 0.3,
+    'miss': 0.2,
+}
+RETRY_QUOTA = 0.2
+
+
+def task_priority(task_type: str, topic: dict = None, now: datetime.datetime = None) -> float:
+    '''任务优先提前量（分钟）
+
+    由任务类型、主题发布时间、上次爬取时间及得分/回复增速决定'''
+    boost = TYPE_BOOST.get(task_type, RETRY_BOOST)
+    if not topic:
+        return boost
+
+    now = now or datetime.datetime.now()
+    if topic.get('date'):
+        age = max((now - topic['date']).total_seconds() / 3600, 1)
+        # 新主题更活跃，一个月内线性衰减
+        boost += max(0, 30 - age / 24)
+        # 得分及回复增速
+        boost += 5 * math.log1p(topic.get('score', 0) / age)
+        boost += 5 * math.log1p(topic.get('reply', 0) / age)
+    if topic.get('spiderTime'):
+        # 越久没爬越优先，最多一天
+        boost += min((now - topic['spiderTime']).total_seconds() / 3600, 24)
+    return boost
+
+
+def task_rank(task_type: str, topic: dict = None, now: datetime.datetime = None) -> datetime.datetime:
+    '''分配排序字段，越小越先分配
+
+    创建时间减去优先提前量，排队越久的任务自然排到前面（老化）'''
+    now = now or datetime.datetime.now()
+    return now - datetime.timedelta(minutes=task_priority(task_type, topic, now))
+
+
+def type_quota(task_type: str) -> float:
+    return TYPE_QUOTA.get(task_type, RETRY_QUOTA)
+
+
+def select_with_quota(candidates: list, n: int) -> list:
+    '''按 rank 顺序挑选 n 个任务，每类不超过配额，配额用完仍不足时按顺序补足'''
+    counts = {}
+    selected, rest = [], []
+    for i in candidates:
+        task_type = i.get('type')
+        if counts.get(task_type, 0) < math.ceil(n * type_quota(task_type)):
+            counts[task_type] = counts.get(task_type, 0) + 1
+            selected.append(i)
+        else:
+            rest.append(i)
+        if len(selected) >= n:
+            return selected
+    return selected + rest[:n - len(selected)]
@@ -0,0 +1,80 @@
+from collections import Counter
+import datetime
+import asyncio
+
+from database import db
+from metrics import queue_depth
+
+STATS_ID = 'dashboard'
+
+
+async def incr(**fields):
+    '''增量更新统计，忽略为 0 的字段'''
+    fields = {k: v for k, v in fields.items() if v}
+    if fields:
+        await db.stats.update_one({'_id': STATS_ID}, {'$inc': fields}, upsert=True)
+
+
+def by_type(state: str, types, sign: int = 1) -> dict:
+    '''按任务类型拆分的增量字段，如 {'task_types.pending.change': 2}
+
+    state 为 total、pending、not_complete，types 为各任务的类型'''
+    return {f'task_types.{state}.{k}': sign * v for k, v in Counter(i or 'unknown' for i in types).items()}
+
+
+async def get_stats() -> dict:
+    return await db.stats.find_one({'_id': STATS_ID}) or {}
+
+
+async def reconcile():
+    '''重新统计修正增量更新的偏差，并计算与时间相关的主题统计'''
+    now = datetime.datetime.now()
+    counts = await asyncio.gather(
+        db.task.count_documents({}),
+        db.task.count_documents({'distribute_time': None}),
+        db.task.count_documents({'complete_time': None}),
+        db.error.count_documents({}),
+        # 近一月超三天未爬取主题数
+        db.topic.count_documents({
+            'date': {'$gte': now - datetime.timedelta(days=30)},
+            'spiderTime': {'$lte': now - datetime.timedelta(days=3)}
+        }),
+        # 超两周未爬取主题数
+        db.topic.count_documents({
+            'spiderTime': {'$lte': now - datetime.timedelta(days=14)}
+        }),
+        db.topic.find_one(sort=[('id', -1)], projection=['id']),
+        db.task.aggregate([{'$group': {
+            '_id': '$type',
+            'total': {'$sum': 1},
+            'pending': {'$sum': {'$cond': [{'$eq': [{'$ifNull': ['$distribute_time', None]}, None]}, 1, 0]}},
+            'not_complete': {'$sum': {'$cond': [{'$eq': [{'$ifNull': ['$complete_time', None]}, None]}, 1, 0]}},
+        }}]).to_list(None),
+    )
+    task_types = {
+        state: {i['_id'] or 'unknown': i[state] for i in counts[7]}
+        for state in ('total', 'pending', 'not_complete')
+    }
+    await db.stats.update_one({'_id': STATS_ID}, {'$set': {
+        'task_total': counts[0],
+        'task_pending': counts[1],
+        'task_not_complete': counts[2],
+        'error_total': counts[3],
+        'topic_recent_total': counts[4],
+        'topic_recent_2w_total': counts[5],
+        'latest_topic_id': counts[6]['id'] if counts[6] else 0,
+        'task_types': task_types,
+        'reconcile_time': now,
+    }}, upsert=True)
+
+
+async def refresh_queue_depth():
+    '''由增量维护的统计文档得到各类型、各状态任务数，只读一个文档
+
+    各计数在任务新建、分配、完成、删除时 $inc 更新，偏差由 reconcile 定时修正'''
+    task_types = (await get_stats()).get('task_types', {})
+    total, pending, not_complete = (task_types.get(i, {}) for i in ('total', 'pending', 'not_complete'))
+    for task_type in set(total) | set(pending) | set(not_complete):
+        queue_depth.set(pending.get(task_type, 0), type=task_type, state='pending')
+        queue_depth.set(not_complete.get(task_type, 0) - pending.get(task_type, 0), type=task_type, state='leased')
+        queue_depth.set(total.get(task_type, 0) - not_complete.get(task_type, 0), type=task_type, state='completed')
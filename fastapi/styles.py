@@ -0,0 +1,75 @@
+import hashlib
+import asyncio
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from database import db
+
+
+class StyleAsset:
+    '''预压缩的样式表，以内容哈希作为 ETag'''
+
+    def __init__(self, name: str, css: str):
+        self.name = name
+        self.body = css.encode()
+        self.hash = hashlib.sha256(self.body).hexdigest()[:16]
+        self.etag = f'"{self.hash}"'
+        self.encodings = {'gzip': gzip.compress(self.body, 9)}
+        if brotli:
+            self.encodings['br'] = brotli.compress(self.body, quality=11)
+
+    def negotiate(self, accept_encoding: str):
+        '''按 Accept-Encoding 选择压缩格式，返回 (编码, 内容)'''
+        accepted = {i.split(';')[0].strip() for i in (accept_encoding or '').split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.encodings:
+                return encoding, self.encodings[encoding]
+        return None, self.body
+
+
+class StyleTable:
+    '''样式内存表，内容变化时才重新压缩'''
+
+    def __init__(self):
+        self.assets = {}
+
+    def put(self, name: str, css: str) -> StyleAsset:
+        asset = self.assets.get(name)
+        if asset is None or asset.body != css.encode():
+            asset = StyleAsset(name, css)
+            self.assets[name] = asset
+        return asset
+
+    async def load_all(self):
+        styles = await db.style.find({}, {'github': 1, 'css': 1}).to_list(None)
+        for i in styles:
+            # 压缩较耗 CPU，放到线程中执行
+            await asyncio.to_thread(self.put, i['github'], i['css'])
+        names = {i['github'] for i in styles}
+        for name in set(self.assets) - names:
+            del self.assets[name]
+
+    async def get(self, name: str) -> StyleAsset:
+        if name not in self.assets:
+            style = await db.style.find_one({'github': name}, {'css': 1})
+            if not style:
+                return None
+            await asyncio.to_thread(self.put, name, style['css'])
+        return self.assets[name]
+
+
+style_table = StyleTable()
+
+
+async def refresh_styles(interval: int = 300):
+    '''每个 worker 进程各自定时同步样式'''
+    while True:
+        try:
+            await style_table.load_all()
+        except Exception as e:
+            print('加载样式失败', e)
+        await asyncio.sleep(interval)
@@ -1,39 +1,45 @@
-from functools import wraps
-import traceback
+from pymongo import UpdateOne, DeleteMany
 import datetime
 import asyncio
-import aiohttp
 import re
 
-from tools import localtime, page_range, new_task, send_msg_to_tg, generate_weekly
+from tools import localtime, page_range, new_tasks, send_msg_to_tg, parse_error
+from weekly import generate_weekly, render_weekly
+from leaderboard import rebuild
+from miss_topic import check_missing_topics
 from model import Topic
 from database import db
+from httpclient import http, V2EX_URL
+from leader import leader
+from cron import Job
+from stats import incr, by_type, reconcile
 
 TASKS = []
-def bg_task(s: int):
+def bg_task(s: int = None, **options):
+    '''注册定时任务，s 为运行间隔秒数，或通过 cron= 指定 cron 表达式（UTC+8）
+
+    其余参数见 cron.Job: jitter、timeout、catch_up'''
     def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            while True:
-                try:
-                    await func(*args, **kwargs)
-                except Exception as e:
-                    print('='*20)
-                    print(func.__name__)
-                    print(e)
-                    traceback.print_exc()
-                    print('='*20)
-                await asyncio.sleep(s)
-        TASKS.append(wrapper)
-        return wrapper
+        TASKS.append(Job(func, interval=s, **options))
+        return func
     return decorator
 
 async def run_task():
-    for func in TASKS:
-        asyncio.create_task(func())
+    '''只有选举出的 leader 进程运行定时任务'''
+    running = []
+
+    async def start():
+        running.extend(asyncio.create_task(job.run_forever()) for job in TASKS)
+
+    async def stop():
+        for i in running:
+            i.cancel()
+        running.clear()
+
+    await leader.run(start, stop)
 
 
-@bg_task(30)
+@bg_task(30, jitter=5, timeout=120)
 async def generate_task():
     '''定时任务: 生成长时间未更新主题的爬取任务'''
 
@@ -42,126 +48,200 @@ async def generate_task():
     if await db.task.count_documents({'distribute_time': None}) >= 100:
         return
 
+    fields = ['id', 'reply', 'spiderTime', 'date', 'score']
+
     # 最久没更新的 1000 个主题
     topic_oldest = await db.topic.find({
         'spiderTime': {'$lte': datetime.datetime.now() - datetime.timedelta(days=7)}
-    }).sort("spiderTime").limit(1000).to_list(1000)
-    for i in topic_oldest:
-        for page in page_range(i['reply']):
-            await new_task(i['id'], page, 'oldest')
+    }, fields).sort("spiderTime").limit(1000).to_list(1000)
 
     # 最近一个月的 100 个主题
     topic_recent = await db.topic.find({
             'date': {'$gte': datetime.datetime.now() - datetime.timedelta(days=30)},
             'spiderTime': {'$lte': datetime.datetime.now() - datetime.timedelta(hours=3)}
-        }).sort("spiderTime").limit(100).to_list(100)
+        }, fields).sort("spiderTime").limit(100).to_list(100)
 
-    for i in topic_recent:
-        for page in page_range(i['reply']):
-            await new_task(i['id'], page, 'recent')
+    await new_tasks(
+        [(i['id'], page, 'oldest', i) for i in topic_oldest for page in page_range(i['reply'])] +
+        [(i['id'], page, 'recent', i) for i in topic_recent for page in page_range(i['reply'])]
+    )
 
 
-@bg_task(300)
+@bg_task(300, jitter=30, timeout=120)
 async def topic_change():
     '''定时任务: 网站最近更新 https://www.v2ex.com/changes'''
 
     print('获取最新更新主题')
-    async with aiohttp.request('GET', 'https://www.v2ex.com/changes') as r:
-        topic_list = re.findall(r'/t/(\d+?)#reply(\d+)', await r.text())
-        topic_list = list(set(topic_list))  # 去重
-        for id, reply_num in topic_list:
-            id = int(id)
-            reply_num = int(reply_num)
-            topic = await db.topic.find_one({'id': id})
-            # 排除评论无变化
-            if topic and topic['reply'] == reply_num:
-                continue
-
-            for page in page_range(reply_num):
-                await new_task(id, page, 'change')
-
-
-@bg_task(60)
+    html = await http.fetch_if_changed(f'{V2EX_URL}/changes')
+    if html is None:
+        print('最新更新无变化')
+        return
+    topic_list = re.findall(r'/t/(\d+?)#reply(\d+)', html)
+
+    topic_list = {int(id): int(reply_num) for id, reply_num in topic_list}  # 去重
+    topics = await db.topic.find(
+        {'id': {'$in': list(topic_list)}}, ['id', 'reply', 'spiderTime', 'date', 'score']
+    ).to_list(None)
+    topics = {i['id']: i for i in topics}
+
+    # 排除评论无变化
+    await new_tasks(
+        (id, page, 'change', topics.get(id))
+        for id, reply_num in topic_list.items()
+        if id not in topics or topics[id]['reply'] != reply_num
+        for page in page_range(reply_num)
+    )
+
+
+@bg_task(60, timeout=60)
 async def delete_task():
     '''定时任务: 清除已完成的爬虫任务'''
 
     print('清除已完成的爬虫任务')
-    await db.task.delete_many({
+    await delete_tasks({
         'complete_time': {'$ne': None},
         # 'distribute_time': {'$ne': None}
     })
-    # 重爬超时任务（任务要么完成要么报错进入 Error 处理）
-    await db.task.update_many({
+    # 租约过期的任务在分配时直接回收，这里只重置没有租约的旧任务
+    expired = {
         'distribute_time': {'$lte': datetime.datetime.now() - datetime.timedelta(seconds=60)},
-        'complete_time': None
-    }, {
+        'complete_time': None,
+        'lease_expire': {'$exists': False},
+    }
+    tasks = await db.task.find(expired, {'type': 1}).to_list(None)
+    if not tasks:
+        return
+    result = await db.task.update_many({**expired, '_id': {'$in': [i['_id'] for i in tasks]}}, {
         '$set': {
            'distribute_time': None,
            'sign': 'reset'
         }
     })
+    await incr(task_pending=result.modified_count, **by_type('pending', [i.get('type') for i in tasks]))
 
 
-@bg_task(600)
+@bg_task(600, timeout=600)
 async def delete_error():
     '''定时任务: 清理错误'''
     print('清理错误')
 
-    def get_id_page(url):
-        result = re.search(r'/t/(\d+)', i['url'])
-        if not result:
-            return None, None
-            
-        topic_id = int(result.group(1))
-        page = re.search(r'=(\d+)', i['url'])
-        page = int(page.group(1)) if page else 1
-        return topic_id, page
+    # 旧数据补上解析后的字段
+    legacy = await db.error.find({'code': {'$exists': False}}, ['url', 'error']).to_list(1000)
+    if legacy:
+        await db.error.bulk_write([
+            UpdateOne({'_id': i['_id']}, {'$set': parse_error(i['url'], i['error'])}) for i in legacy
+        ], ordered=False)
+
+    # url 错误的直接删除；旧数据每次只补 1000 条，尚未补字段的不能当作 url 错误
+    deleted = (await db.error.delete_many({'code': {'$exists': True}, 'topic_id': None})).deleted_count
 
     # 404 错误删除任务创建一个 0 分主题
-    errors = await db.error.find({'error': {'$regex': r'错误码404'}}).to_list(1000)
-    for i in errors:
-        await db.error.delete_one({'_id': i['_id']})
-        topic_id, page = get_id_page(i['url'])
-        if topic_id:
-            await db.task.delete_many({'id': topic_id})
-            await db.topic.update_one(
-                {'id': topic_id},
-                {"$set": Topic(
-                    spiderTime = datetime.datetime(2999,1,1),
-                    date = datetime.datetime(2999,1,1),
-                    id = topic_id, name = '', node = '',
-                    author = '', avatar = '', reply = 0,
-                    vote = 0, click = 0, collect = 0,
-                    thank = 0, score = 0, content = '',
-                    append = [], replys = [],
-                ).dict()
-            }, upsert=True)
+    topic_ids = await db.error.distinct('topic_id', {'code': '404'})
+    if topic_ids:
+        placeholder = Topic(
+            spiderTime = datetime.datetime(2999,1,1),
+            date = datetime.datetime(2999,1,1),
+            id = 0, name = '', node = '',
+            author = '', avatar = '', reply = 0,
+            vote = 0, click = 0, collect = 0,
+            thank = 0, score = 0, content = '',
+            append = [], replys = [],
+        ).dict()
+        await asyncio.gather(
+            delete_tasks({'id': {'$in': topic_ids}}),
+            db.topic.bulk_write([
+                UpdateOne({'id': i}, {'$set': {**placeholder, 'id': i}}, upsert=True) for i in topic_ids
+            ], ordered=False),
+        )
+        deleted += (await db.error.delete_many({'code': '404', 'topic_id': {'$in': topic_ids}})).deleted_count
 
     # 403、502、post 错误需要删除错误重爬一次
-    for rekey in [r'错误码502', r'at post',r'错误码403']:
-        errors = await db.error.find({'error': {'$regex': rekey}}).to_list(1000)
-        for i in errors:
-            await db.error.delete_one({'_id': i['_id']})
-            topic_id, page = get_id_page(i['url'])
-            if topic_id:
-                await new_task(topic_id, page, rekey)
+    retry = await db.error.aggregate([
+        {'$match': {'code': {'$in': ['502', 'post', '403']}}},
+        {'$group': {'_id': {'topic_id': '$topic_id', 'page': '$page'}, 'code': {'$first': '$code'}, 'ids': {'$push': '$_id'}}},
+    ]).to_list(None)
+    if retry:
+        await new_tasks((i['_id']['topic_id'], i['_id']['page'], i['code']) for i in retry)
+        deleted += (await db.error.delete_many({'_id': {'$in': [j for i in retry for j in i['ids']]}})).deleted_count
 
     # 其余错误（主要是 get 和 null）无法判断，大部分重爬可以解决
-    errors = await db.error.find().to_list(1000)
-    for i in errors:
-        topic_id, page = get_id_page(i['url'])
-        if not topic_id:
-            # url 错误的直接删除
-            await db.error.delete_one({'_id': i['_id']})
-            return
-        # 发生错误之后主题更新过则删除错误 TODO 考虑小概率多页主题只是某页出错
-        topic = await db.topic.find_one({'id': topic_id})
-        if topic and i['time'] <= topic['spiderTime']:
-            await db.error.delete_one({'_id': i['_id']})
-        if await db.error.count_documents({'url': {'$regex': r'/t/%s\?p=%s' % (topic_id, page)}}) < 10:
-            await new_task(topic_id, page, rekey)
+    groups = await db.error.aggregate([
+        {'$match': {'code': 'other'}},
+        {'$group': {
+            '_id': {'topic_id': '$topic_id', 'page': '$page'},
+            'count': {'$sum': 1},
+            'last': {'$max': '$time'},
+        }},
+        # 先限制条数再关联，避免对所有错误分组执行 $lookup
+        {'$limit': 1000},
+        {'$lookup': {
+            'from': 'topic',
+            'localField': '_id.topic_id',
+            'foreignField': 'id',
+            'pipeline': [{'$project': {'_id': 0, 'spiderTime': 1}}],
+            'as': 'topic',
+        }},
+    ]).to_list(1000)
+
+    # 发生错误之后主题更新过则删除错误 TODO 考虑小概率多页主题只是某页出错
+    resolved, retry, manual = [], [], []
+    for i in groups:
+        spider_time = i['topic'][0]['spiderTime'] if i['topic'] else None
+        if spider_time:
+            resolved.append(DeleteMany({**i['_id'], 'code': 'other', 'time': {'$lte': spider_time}}))
+        if spider_time and i['last'] <= spider_time:
+            continue
+        if i['count'] < 10:
+            retry.append((i['_id']['topic_id'], i['_id']['page'], 'other'))
         else:
-            await send_msg_to_tg('主题需要人工处理错误 https://v2ex.com/t/%s?p=%s' % (topic_id, page))
+            manual.append('https://v2ex.com/t/%s?p=%s' % (i['_id']['topic_id'], i['_id']['page']))
+
+    if resolved:
+        deleted += (await db.error.bulk_write(resolved, ordered=False)).deleted_count
+    await incr(error_total=-deleted)
+    await new_tasks(retry)
+    if manual:
+        await send_msg_to_tg('主题需要人工处理错误\n' + '\n'.join(manual))
+
+
+async def delete_tasks(filter):
+    '''删除任务并更新统计'''
+    tasks = await db.task.find(filter, {'distribute_time': 1, 'complete_time': 1, 'type': 1}).to_list(None)
+    if not tasks:
+        return
+    await db.task.delete_many({'_id': {'$in': [i['_id'] for i in tasks]}})
+    pending = [i.get('type') for i in tasks if i.get('distribute_time') is None]
+    not_complete = [i.get('type') for i in tasks if i.get('complete_time') is None]
+    await incr(
+        task_total=-len(tasks),
+        task_pending=-len(pending),
+        task_not_complete=-len(not_complete),
+        **by_type('total', [i.get('type') for i in tasks], -1),
+        **by_type('pending', pending, -1),
+        **by_type('not_complete', not_complete, -1),
+    )
+
+
+@bg_task(600, jitter=30, timeout=300)
+async def reconcile_stats():
+    '''定时任务: 重新统计首页数据，修正增量统计偏差'''
+    print('重新统计首页数据')
+    await reconcile()
+
+
+@bg_task(3600, jitter=60, timeout=600)
+async def miss_topic():
+    '''定时任务: 检查缺失的主题 ID'''
+    print('检查缺失的主题')
+    await check_missing_topics()
+
+
+@bg_task(3600, jitter=60, timeout=1800)
+async def rebuild_leaderboard():
+    '''定时任务: 重建最近一周的榜单，修正增量更新的偏差'''
+    print('重建最近一周的榜单')
+    today = localtime(datetime.datetime.now()).date()
+    await rebuild(today - datetime.timedelta(days=7), today)
 
 
 # @bg_task(60*60*12)
@@ -171,26 +251,23 @@ async def a2_task():
     print('检查 A2 是否过期')
     A2 = (await db.info.find_one())['A2']
     cookies = {'A2': A2}
-    async with aiohttp.request('GET', 'https://v2ex.com/about', cookies=cookies) as r:
-        result = re.search(r'/signout\?once=(\d+)', await r.text())
+    r = await http.fetch('GET', f'{V2EX_URL}/about', cookies=cookies)
+    result = re.search(r'/signout\?once=(\d+)', await r.text())
 
-        if result:
-            print('A2 状态正常')
-        else:
-            await send_msg_to_tg('A2 过期，请协助: https://vdaily.huguotao.com/a2')
+    if result:
+        print('A2 状态正常')
+    else:
+        await send_msg_to_tg('A2 过期，请协助: https://vdaily.huguotao.com/a2')
 
 
-# @bg_task(30)
+# @bg_task(cron='0 9 * * 0', catch_up=12*3600, timeout=600)
 async def weekly_task():
     # 每周日早上 9:00 自动发布周报
     # 现在该任务暂时不执行，替换为发布内部周报
     today = localtime(datetime.datetime.now())
-    if today.weekday() != 6 or today.hour != 9 or today.minute > 5:
-        print('没到发送周报的时间', today)
-        return
 
     saturday = today.replace(hour=0, minute=0, second=0) - datetime.timedelta(days=(today.weekday() + 2))
-    title, content = await generate_weekly(saturday)
+    title, content = await generate_weekly(saturday, fresh=True)
 
     weekly = await db.weekly.find_one({'title': title})
     if weekly:
@@ -199,50 +276,49 @@ async def weekly_task():
     
     print('开始发布周报')
 
-    url = 'https://www.v2ex.com/write?node=share'
+    url = f'{V2EX_URL}/write?node=share'
     A2 = (await db.info.find_one())['A2']
     cookies = {'A2': A2}
-    async with aiohttp.ClientSession(cookies=cookies) as session:
-        async with session.get(url) as resp:
-            result = re.search(r'/signout\?once=(\d+)', await resp.text())
-            if not result:
-                return 'A2 过期' + A2
-            once = int(result.group(1))
-        payload = {
-            'title': title,
-            'content': content,
-            'syntax': 'markdown',
-            'node_name': 'share',
-            'once': once
-        }
-        async with session.post(url, data=payload) as resp:
-            html = await resp.text()
-            result = re.search(r'/t/(\d+)#reply0', html)
-            if not result:
-                print('发布失败')
-                print(html)
-                return
-            topic_id = result.group(1)
+    resp = await http.fetch('GET', url, cookies=cookies)
+    result = re.search(r'/signout\?once=(\d+)', await resp.text())
+    if not result:
+        return 'A2 过期' + A2
+    once = int(result.group(1))
+    payload = {
+        'title': title,
+        'content': content,
+        'syntax': 'markdown',
+        'node_name': 'share',
+        'once': once
+    }
+    # 发帖不重试，避免重复发布
+    resp = await http.fetch('POST', url, retries=0, cookies=cookies, data=payload)
+    html = await resp.text()
+    result = re.search(r'/t/(\d+)#reply0', html)
+    if not result:
+        print('发布失败')
+        print(html)
+        return
+    topic_id = result.group(1)
     
     await db.weekly.insert_one({
         'title': title,
         'content': content,
+        **await asyncio.to_thread(render_weekly, content),
         'id': topic_id,
         'date': datetime.datetime.now()
     })
     print(f'发布成功 https://v2ex.com/t/{topic_id}')
 
 
-@bg_task(30)
+# 停机错过时 12 小时内补发（仍在周日，周报日期计算不变）
+@bg_task(cron='0 9 * * 0', catch_up=12*3600, timeout=600)
 async def weekly_predigest_task():
     # 每周日早上 9:00 自动发布周报（内部版）
     today = localtime(datetime.datetime.now())
-    if today.weekday() != 6 or today.hour != 9 or today.minute > 5:
-        print('没到发送周报的时间', today)
-        return
 
     saturday = today.replace(hour=0, minute=0, second=0) - datetime.timedelta(days=(today.weekday() + 2))
-    title, content = await generate_weekly(saturday)
+    title, content = await generate_weekly(saturday, fresh=True)
 
     weekly = await db.weekly.find_one({'title': title})
     if weekly:
@@ -254,6 +330,7 @@ async def weekly_predigest_task():
     await db.weekly.insert_one({
         'title': title,
         'content': content,
+        **await asyncio.to_thread(render_weekly, content),
         'id': 934841, # 写死之前的周报
         'date': datetime.datetime.now()
     })
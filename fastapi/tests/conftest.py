@@ -0,0 +1,60 @@
+'''在 fastapi 目录下运行: python -m pytest tests'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCollection:
+    '''模拟 Motor 集合: 查询返回固定的文档，写操作只记录下来'''
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.writes = []
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, *args, **kwargs):
+        return self
+
+    async def __aiter__(self):
+        for doc in self.docs:
+            yield doc
+
+    async def to_list(self, length):
+        return self.docs
+
+    async def find_one(self, *args, **kwargs):
+        return self.docs[0] if self.docs else None
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes += ops
+
+    async def update_one(self, filter, update, upsert=False):
+        self.writes.append((filter, update))
+
+
+class FakeDB(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    '''用 FakeDB 替换模块中的 db: fake_db('tools', reply=[...])'''
+
+    def install(module: str, **collections):
+        db = FakeDB({k: FakeCollection(v) for k, v in collections.items()})
+        monkeypatch.setattr(f'{module}.db', db)
+        return db
+
+    return install
@@ -0,0 +1,54 @@
+import asyncio
+
+from cache import ResponseCache
+
+
+def test_waiters_survive_first_caller_cancel():
+    async def main():
+        store = ResponseCache('test')
+        release = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return 'result'
+
+        first = asyncio.create_task(store.get_or_compute('k', compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(store.get_or_compute('k', compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == 'result'
+        assert first.cancelled()
+        assert calls == [1]
+        assert store.stats['misses'] == 1 and store.stats['coalesced'] == 1 and store.stats['hits'] == 0
+        assert await store.get_or_compute('k', compute) == 'result'
+        assert store.stats['hits'] == 1
+
+    asyncio.run(main())
+
+
+def test_error_is_not_cached():
+    async def main():
+        store = ResponseCache('test')
+
+        async def fail():
+            raise ValueError
+
+        for _ in range(2):
+            try:
+                await store.get_or_compute('k', fail)
+            except ValueError:
+                pass
+        assert store.stats['misses'] == 2 and not store.entries
+
+    asyncio.run(main())
+
+
+def test_sizeof_counts_nested_values():
+    flat = ResponseCache.sizeof([])
+    nested = ResponseCache.sizeof([{'content': 'x' * 10000}])
+    assert nested - flat > 10000
@@ -0,0 +1,48 @@
+import ipaddress
+
+from starlette.requests import Request
+
+import main
+from main import client_id
+
+
+def request(peer, forwarded=None):
+    headers = [(b'x-forwarded-for', forwarded.encode())] if forwarded else []
+    return Request({'type': 'http', 'headers': headers, 'client': (peer, 1234)})
+
+
+def trust(monkeypatch, *networks):
+    monkeypatch.setattr(main, 'TRUSTED_PROXIES', [ipaddress.ip_network(i) for i in networks])
+
+
+def test_forwarded_is_ignored_by_default():
+    assert client_id(request('8.8.8.8', '10.0.0.1')) == '8.8.8.8'
+
+
+def test_forwarded_is_ignored_from_untrusted_peer(monkeypatch):
+    trust(monkeypatch, '172.17.0.1')
+    assert client_id(request('8.8.8.8', '10.0.0.1')) == '8.8.8.8'
+
+
+def test_rightmost_untrusted_address_from_trusted_proxies(monkeypatch):
+    trust(monkeypatch, '172.17.0.0/16', '10.0.0.2')
+    # 客户端伪造的 1.1.1.1 在最左边，不会被采用
+    assert client_id(request('172.17.0.1', '1.1.1.1, 9.9.9.9, 10.0.0.2')) == '9.9.9.9'
+
+
+def test_only_proxies_in_chain(monkeypatch):
+    trust(monkeypatch, '172.17.0.1')
+    assert client_id(request('172.17.0.1', '172.17.0.1')) == '172.17.0.1'
+
+
+def test_spoofed_forwarded_does_not_open_internal_endpoints(monkeypatch):
+    monkeypatch.setattr(main, 'INTERNAL_TOKEN', None)
+    assert not main.internal(request('8.8.8.8', '10.0.0.1'))
+    assert main.internal(request('10.0.0.1'))
+
+
+def test_internal_token(monkeypatch):
+    monkeypatch.setattr(main, 'INTERNAL_TOKEN', 'secret')
+    assert not main.internal(request('10.0.0.1'))
+    r = Request({'type': 'http', 'headers': [(b'authorization', b'Bearer secret')], 'client': ('8.8.8.8', 1)})
+    assert main.internal(r)
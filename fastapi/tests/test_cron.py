@@ -0,0 +1,116 @@
+import datetime
+import asyncio
+
+import pytest
+
+import cron
+
+
+class FakeJobs:
+    def __init__(self):
+        self.updates = []
+
+    async def update_one(self, filter, update, upsert=False):
+        self.updates.append(update)
+
+
+class FakeDB:
+    def __init__(self):
+        self.job = FakeJobs()
+
+
+def test_execute_records_start_before_running_and_increments(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(cron, 'db', db)
+    seen = []
+
+    async def work():
+        seen.append(len(db.job.updates))
+
+    job = cron.Job(work, interval=60)
+    asyncio.run(job.execute())
+    start, end = db.job.updates
+    # 任务运行前已写入 last_start
+    assert seen == [1]
+    assert 'last_start' in start['$set'] and start['$inc']['runs'] == 1
+    assert end['$inc']['success'] == 1 and '$set' in end
+    assert all('$set' not in u or 'runs' not in u['$set'] for u in db.job.updates)
+
+
+def test_failure_is_counted(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(cron, 'db', db)
+
+    async def boom():
+        raise RuntimeError('x')
+
+    asyncio.run(cron.Job(boom, interval=60).execute())
+    assert db.job.updates[-1]['$inc']['failure'] == 1
+    assert 'RuntimeError' in db.job.updates[-1]['$set']['last_error']
+
+
+def local(*args):
+    return datetime.datetime(*args, tzinfo=cron.TZ)
+
+
+@pytest.mark.parametrize('expr, expected', [
+    ('*', set(range(0, 60))),
+    ('5', {5}),
+    ('*/15', {0, 15, 30, 45}),
+    ('5/20', {5, 25, 45}),
+    ('10-20/5', {10, 15, 20}),
+    ('1,2,50-52', {1, 2, 50, 51, 52}),
+])
+def test_parse_field(expr, expected):
+    assert cron.parse_field(expr, 0, 59) == expected
+
+
+@pytest.mark.parametrize('expr', ['60', '5-70', '*/0', 'x'])
+def test_parse_field_rejects(expr):
+    with pytest.raises(ValueError):
+        cron.parse_field(expr, 0, 59)
+
+
+def test_sunday_is_0_or_7():
+    # 2024-01-07 是周日
+    assert cron.Cron('0 9 * * 7').match(local(2024, 1, 7, 9, 0))
+    assert cron.Cron('0 9 * * 0').match(local(2024, 1, 7, 9, 0))
+    assert not cron.Cron('0 9 * * 0').match(local(2024, 1, 8, 9, 0))
+
+
+def test_day_of_month_or_day_of_week():
+    c = cron.Cron('0 0 1 * 1')
+    assert c.match(local(2024, 1, 1))   # 1 号（周一）
+    assert c.match(local(2024, 2, 1))   # 1 号（周四）
+    assert c.match(local(2024, 1, 8))   # 周一
+    assert not c.match(local(2024, 1, 9))
+    # 只限定其一时按该字段
+    assert not cron.Cron('0 0 1 * *').match(local(2024, 1, 8))
+    assert not cron.Cron('0 0 */2 * 1').match(local(2024, 1, 9))
+    assert cron.Cron('0 0 */2 * 1').match(local(2024, 1, 15))
+
+
+def test_next_and_prev():
+    c = cron.Cron('30 9 * * 0')
+    assert c.next(local(2024, 1, 7, 9, 30)) == local(2024, 1, 14, 9, 30)
+    assert c.next(local(2024, 1, 7, 9, 29, 59)) == local(2024, 1, 7, 9, 30)
+    assert c.prev(local(2024, 1, 7, 12), datetime.timedelta(hours=3)) == local(2024, 1, 7, 9, 30)
+    assert c.prev(local(2024, 1, 7, 12), datetime.timedelta(hours=2)) is None
+
+
+def test_next_converts_to_utc8():
+    utc = datetime.datetime(2024, 1, 7, 1, 0, tzinfo=datetime.timezone.utc)  # UTC+8 09:00
+    assert cron.Cron('30 9 * * *').next(utc) == local(2024, 1, 7, 9, 30)
+
+
+@pytest.mark.parametrize('last_start, missed', [
+    (None, True),
+    (local(2024, 1, 7, 9, 0), False),
+    (local(2024, 1, 6, 9, 0), True),
+])
+def test_catch_up_window(fake_db, last_start, missed):
+    fake_db('cron', job=[{'last_start': last_start}] if last_start else [])
+    job = cron.Job(lambda: None, cron='0 9 * * *', catch_up=3 * 3600)
+    assert asyncio.run(job.missed(local(2024, 1, 7, 11))) is missed
+    # 超出补跑窗口的触发不再补跑
+    assert asyncio.run(job.missed(local(2024, 1, 7, 13))) is False
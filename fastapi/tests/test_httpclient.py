@@ -0,0 +1,101 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import aiohttp
+import pytest
+
+from httpclient import HttpClient
+
+
+def flaky(failures: int, delay: float = 0):
+    '''前 failures 次返回 503 的模拟服务'''
+    calls = []
+
+    async def handler(request):
+        calls.append(request.method)
+        await asyncio.sleep(delay)
+        if len(calls) <= failures:
+            return web.Response(status=503)
+        return web.Response(text='ok', headers={'ETag': '"v1"'})
+
+    app = web.Application()
+    app.router.add_route('*', '/', handler)
+    return TestServer(app), calls
+
+
+async def fetch(server, method, **kwargs):
+    client = HttpClient(retries=3, backoff=0, timeout=kwargs.pop('timeout', 5))
+    try:
+        return await client.fetch(method, str(server.make_url('/')), **kwargs)
+    finally:
+        await client.close()
+
+
+def test_get_is_retried_on_5xx():
+    async def main():
+        server, calls = flaky(2)
+        async with server:
+            resp = await fetch(server, 'GET')
+        assert resp.status == 200 and await resp.text() == 'ok'
+        assert calls == ['GET'] * 3
+
+    asyncio.run(main())
+
+
+def test_body_is_kept_after_release():
+    async def main():
+        server, calls = flaky(0)
+        async with server:
+            resp = await fetch(server, 'GET')
+        assert resp.body == b'ok'
+
+    asyncio.run(main())
+
+
+def test_post_is_not_retried_by_default():
+    async def main():
+        server, calls = flaky(1)
+        async with server:
+            resp = await fetch(server, 'POST', json={})
+        assert resp.status == 503
+        assert calls == ['POST']
+
+    asyncio.run(main())
+
+
+def test_post_retries_when_requested():
+    async def main():
+        server, calls = flaky(1)
+        async with server:
+            resp = await fetch(server, 'POST', retries=1, json={})
+        assert resp.status == 200
+        assert calls == ['POST'] * 2
+
+    asyncio.run(main())
+
+
+def test_timeout_is_retried_then_raised():
+    async def main():
+        server, calls = flaky(0, delay=1)
+        async with server:
+            with pytest.raises((asyncio.TimeoutError, aiohttp.ClientError)):
+                await fetch(server, 'GET', retries=1, timeout=0.1)
+        assert calls == ['GET'] * 2
+
+    asyncio.run(main())
+
+
+def test_fetch_if_changed_skips_unchanged_body():
+    async def main():
+        server, calls = flaky(0)
+        async with server:
+            client = HttpClient(backoff=0)
+            try:
+                url = str(server.make_url('/'))
+                assert await client.fetch_if_changed(url) == 'ok'
+                assert await client.fetch_if_changed(url) is None
+            finally:
+                await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+import asyncio
+
+import ingestbuffer
+from ingestbuffer import IngestBuffer
+
+
+def doc(id, time, **kwargs):
+    return {'id': id, 'spiderTime': time, **kwargs}
+
+
+class Store:
+    '''模拟 save_topics 及 update_leaderboard，可指定失败次数'''
+
+    def __init__(self, monkeypatch, save_failures=0, rank_failures=0):
+        self.saved = []
+        self.ranked = []
+        self.save_failures = save_failures
+        self.rank_failures = rank_failures
+        monkeypatch.setattr(ingestbuffer, 'save_topics', self.save_topics)
+        monkeypatch.setattr(ingestbuffer, 'update_leaderboard', self.update_leaderboard)
+
+    async def save_topics(self, topics, replys, tasks):
+        if self.save_failures:
+            self.save_failures -= 1
+            raise RuntimeError('save')
+        self.saved.append((topics, replys, tasks))
+        return {'topic': topics, 'reply': replys}
+
+    async def update_leaderboard(self, kind, docs):
+        if self.rank_failures:
+            self.rank_failures -= 1
+            raise RuntimeError('rank')
+        if docs:
+            self.ranked.append((kind, [i['id'] for i in docs]))
+
+
+def test_merge_keeps_newest():
+    buffer = IngestBuffer()
+    buffer.put([doc(1, 2, name='new')], [], ['a'])
+    buffer.put([doc(1, 1, name='old')], [], ['b'])
+    buffer.put([doc(2, 1)], [doc(10, 1)], [])
+    assert buffer.topics[1]['name'] == 'new'
+    assert len(buffer) == 3
+    assert buffer.tasks == {'a', 'b'}
+
+
+def test_put_rejects_when_full():
+    buffer = IngestBuffer(max_items=1)
+    assert buffer.put([doc(1, 1)], [], [])
+    assert not buffer.put([doc(2, 1)], [], [])
+    assert list(buffer.topics) == [1]
+
+
+def test_put_wakes_writer_at_batch_size():
+    buffer = IngestBuffer(batch_size=2)
+    buffer.put([doc(1, 1)], [], [])
+    assert not buffer.wakeup.is_set()
+    buffer.put([doc(2, 1)], [], [])
+    assert buffer.wakeup.is_set()
+
+
+def test_failed_save_is_retried_without_overwriting_newer(monkeypatch):
+    store = Store(monkeypatch, save_failures=1)
+
+    async def run():
+        buffer = IngestBuffer()
+        buffer.put([doc(1, 1, name='old'), doc(2, 1)], [], ['a'])
+        await buffer.flush()
+        assert not store.saved and len(buffer) == 2
+        buffer.put([doc(1, 2, name='new')], [], [])
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(run())
+    (topics, _, tasks), = store.saved
+    assert {i['id']: i.get('name') for i in topics} == {1: 'new', 2: None}
+    assert tasks == ['a']
+    assert not buffer.pending()
+
+
+def test_failed_leaderboard_retries_only_leaderboard(monkeypatch):
+    store = Store(monkeypatch, rank_failures=1)
+
+    async def run():
+        buffer = IngestBuffer()
+        buffer.put([doc(1, 1)], [doc(10, 1)], [])
+        await buffer.flush()
+        assert len(store.saved) == 1 and buffer.unranked['topic']
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert len(store.saved) == 1
+    assert ('topic', [1]) in store.ranked and ('reply', [10]) in store.ranked
+    assert not buffer.pending()
+
+
+def test_close_gives_up_after_timeout(monkeypatch, capsys):
+    Store(monkeypatch, save_failures=100)
+
+    async def run():
+        buffer = IngestBuffer(interval=0.01)
+        buffer.put([doc(1, 1)], [doc(10, 1)], [])
+        await buffer.close(timeout=0.05)
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert len(buffer) == 2
+    assert '丢失 1 个主题、1 个回复' in capsys.readouterr().out
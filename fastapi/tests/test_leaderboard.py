@@ -0,0 +1,77 @@
+import datetime
+import asyncio
+
+import pytest
+from pymongo import UpdateOne
+
+from leaderboard import window_periods, periods, page, parse_cursor, update_leaderboard, LOCAL_TZ, TOP_K
+
+
+def local(*args):
+    return datetime.datetime(*args, tzinfo=LOCAL_TZ)
+
+
+def test_whole_months_are_used():
+    assert window_periods(local(2024, 1, 1), local(2024, 3, 1)) == ['2024-01', '2024-02']
+
+
+def test_partial_months_use_days():
+    assert window_periods(local(2024, 1, 30), local(2024, 3, 2, 12)) == [
+        '2024-01-30', '2024-01-31', '2024-02', '2024-03-01', '2024-03-02',
+    ]
+
+
+def test_end_at_midnight_is_exclusive():
+    assert window_periods(local(2024, 2, 27), local(2024, 2, 29)) == ['2024-02-27', '2024-02-28']
+
+
+def test_window_is_read_in_utc8():
+    # UTC 2024-01-31 20:00 即 UTC+8 2024-02-01 04:00
+    utc = datetime.datetime(2024, 1, 31, 20, tzinfo=datetime.timezone.utc)
+    assert window_periods(utc, local(2024, 2, 2)) == ['2024-02-01']
+    assert periods(utc) == ['2024-02-01', '2024-02']
+
+
+def fake_boards(fake_db, *boards):
+    fake_db('leaderboard', leaderboard=[{'items': i} for i in boards])
+
+
+def test_page_follows_cursor_without_gaps(fake_db):
+    fake_boards(
+        fake_db,
+        [{'id': 1, 'score': 9}, {'id': 4, 'score': 5}, {'id': 2, 'score': 1}],
+        [{'id': 5, 'score': 5}, {'id': 3, 'score': 2}],
+    )
+    start, end = local(2024, 1, 1), local(2024, 2, 1)
+    seen, after = [], None
+    while True:
+        items, after = asyncio.run(page('topic', start, end, after, limit=2))
+        seen += [i['id'] for i in items]
+        if not after:
+            break
+    assert seen == [1, 5, 4, 3, 2]
+
+
+def test_last_full_page_has_no_cursor(fake_db):
+    fake_boards(fake_db, [{'id': 1, 'score': 9}, {'id': 2, 'score': 5}])
+    items, after = asyncio.run(page('topic', local(2024, 1, 1), local(2024, 2, 1), limit=2))
+    assert [i['id'] for i in items] == [1, 2]
+    assert after is None
+
+
+@pytest.mark.parametrize('after', ['abc', '1', '1_2_3', '1_x'])
+def test_malformed_cursor(after):
+    with pytest.raises(ValueError):
+        parse_cursor(after)
+
+
+def test_push_skips_boards_already_listing_the_doc(fake_db):
+    db = fake_db('leaderboard', leaderboard=[])
+    doc = {'id': 7, 'score': 5, 'date': local(2024, 1, 2)}
+    asyncio.run(update_leaderboard('topic', [doc]))
+    for period in ('2024-01-02', '2024-01'):
+        assert UpdateOne(
+            {'kind': 'topic', 'period': period, 'items.id': {'$ne': 7}},
+            {'$push': {'items': {'$each': [doc], '$sort': {'score': -1, 'id': -1}, '$slice': TOP_K}},
+             '$inc': {'version': 1}},
+        ) in db.leaderboard.writes
@@ -0,0 +1,122 @@
+import threading
+import asyncio
+import time
+
+import pytest
+
+import logstream
+from logstream import LogHub, FakeLogSource, DockerLogSource
+
+
+def hub(interval=0.01, **kwargs):
+    return LogHub(lambda name: FakeLogSource(name, interval), **kwargs)
+
+
+def test_lines_fan_out_to_every_subscriber():
+    async def main():
+        channel = hub().channel('app')
+        queues = [channel.subscribe(), channel.subscribe()]
+        received = [[await q.get() for _ in range(3)] for q in queues]
+        channel.reader.cancel()
+        return received
+
+    first, second = asyncio.run(main())
+    assert first == second == [f'app log line {i}\n'.encode() for i in (1, 2, 3)]
+
+
+def test_slow_subscriber_keeps_only_newest_lines():
+    async def main():
+        channel = hub(interval=0, queue_size=2).channel('app')
+        queue = channel.subscribe()
+        await asyncio.sleep(0.05)
+        channel.reader.cancel()
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    lines = asyncio.run(main())
+    assert len(lines) == 2
+    assert b'app log line 1\n' not in lines
+
+
+def test_reader_stops_after_idle_timeout():
+    async def main():
+        channel = hub(idle_timeout=0.02).channel('app')
+        channel.unsubscribe(channel.subscribe())
+        reader = channel.reader
+        await asyncio.sleep(0.1)
+        return channel, reader
+
+    channel, reader = asyncio.run(main())
+    assert channel.reader is None and reader.cancelled()
+    assert not channel.buffer
+
+
+def test_resubscribing_keeps_reader_running():
+    async def main():
+        channel = hub(idle_timeout=0.02).channel('app')
+        channel.unsubscribe(channel.subscribe())
+        queue = channel.subscribe()
+        await asyncio.sleep(0.1)
+        running = channel.reader is not None and not channel.reader.done()
+        channel.reader.cancel()
+        return running, queue
+
+    running, queue = asyncio.run(main())
+    assert running and not queue.empty()
+
+
+def test_sse_format():
+    async def main():
+        stream = hub().stream('app', sse=True)
+        line = await stream.__anext__()
+        await stream.aclose()
+        return line
+
+    assert asyncio.run(main()) == 'data: app log line 1\n\n'
+
+
+def test_docker_reader_stops_when_cancelled_before_stream_opens(monkeypatch):
+    release = threading.Event()
+
+    class Stream:
+        closed = False
+
+        def __iter__(self):
+            while not self.closed:
+                yield b'line\n'
+                time.sleep(0.001)
+
+        def close(self):
+            self.closed = True
+
+    stream = Stream()
+
+    class Container:
+        name = 'fastapi'
+
+        def logs(self, **kwargs):
+            release.wait(5)
+            return stream
+
+    class Client:
+        def __init__(self, **kwargs):
+            self.containers = self
+
+        def list(self):
+            return [Container()]
+
+    monkeypatch.setattr(logstream.docker, 'DockerClient', Client)
+
+    async def main():
+        lines = DockerLogSource('fastapi').lines()
+        task = asyncio.create_task(lines.__anext__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        release.set()
+
+    asyncio.run(main())
+    deadline = time.monotonic() + 5
+    while not stream.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stream.closed
@@ -0,0 +1,41 @@
+import asyncio
+
+from metrics import LatencyMiddleware, Histogram, Counter
+
+
+class Route:
+    path = '/items/{id}'
+
+
+def test_latency_middleware_records_route_and_status(monkeypatch):
+    histogram = Histogram('test_latency_seconds', 'test', ('method', 'route', 'status'))
+    monkeypatch.setattr('metrics.http_latency', histogram)
+    sent = []
+
+    async def app(scope, receive, send):
+        scope['route'] = Route()
+        await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(LatencyMiddleware(app)({'type': 'http', 'method': 'GET'}, None, send))
+    assert sent == ['http.response.start', 'http.response.body']
+    assert list(histogram.values) == [('GET', '/items/{id}', '404')]
+
+
+def test_latency_middleware_passes_through_lifespan():
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scope['type'])
+
+    asyncio.run(LatencyMiddleware(app)({'type': 'lifespan'}, None, None))
+    assert called == ['lifespan']
+
+
+def test_render_escapes_label_values():
+    counter = Counter('test_total', 'test', ('name',))
+    counter.inc(name='a"b')
+    assert 'test_total{name="a\\"b"} 1' in counter.render()
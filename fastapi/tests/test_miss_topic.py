@@ -0,0 +1,65 @@
+from array import array
+import asyncio
+
+import pytest
+
+import miss_topic
+from miss_topic import find_gaps, check_missing_topics
+
+
+def test_find_gaps():
+    assert find_gaps(10, array('q', [11, 14, 15, 18])) == [12, 13, 16, 17]
+    assert find_gaps(10, array('q', [11, 12])) == []
+    assert find_gaps(10, array('q')) == []
+
+
+def test_gap_across_blocks_uses_previous_block_end():
+    # 上一块以 20 结束，下一块从 23 开始
+    assert find_gaps(20, array('q', [23, 24])) == [21, 22]
+
+
+@pytest.fixture
+def scan(monkeypatch, fake_db):
+    '''以 ids 作为已有主题执行一次扫描，返回 (生成的任务 id, 保存的高水位)'''
+
+    def run(ids, hwm=None, batch=3, max_tasks=100):
+        monkeypatch.setattr(miss_topic, 'BATCH', batch)
+        monkeypatch.setattr(miss_topic, 'MAX_TASKS', max_tasks)
+        tasks = []
+
+        async def new_tasks(items):
+            tasks.extend(i[0] for i in items)
+
+        monkeypatch.setattr(miss_topic, 'new_tasks', new_tasks)
+        db = fake_db(
+            'miss_topic',
+            topic=[{'id': i} for i in ids if hwm is None or i > hwm],
+            state=[{'_id': 'miss_topic', 'id': hwm}] if hwm is not None else [],
+        )
+        asyncio.run(check_missing_topics())
+        (_, update), = db.state.writes
+        return tasks, update['$set']['id']
+
+    return run
+
+
+def test_gaps_across_block_boundaries(scan):
+    start = miss_topic.START_ID
+    ids = [start + i for i in (1, 2, 5, 6, 9, 10, 11)]
+    tasks, hwm = scan(ids)
+    assert tasks == [start + i for i in (3, 4, 7, 8)]
+    assert hwm == start + 11
+
+
+def test_max_tasks_is_a_soft_cut_off(scan):
+    # 每块 2 个 id，第二块后超过上限，整块处理完才停止，下次从 22 之后继续
+    ids = [10, 14, 18, 22, 26, 30]
+    tasks, hwm = scan(ids, hwm=9, batch=2, max_tasks=4)
+    assert tasks == [11, 12, 13, 15, 16, 17, 19, 20, 21]
+    assert hwm == 22
+
+
+def test_resume_from_stored_mark(scan):
+    tasks, hwm = scan([10, 14, 18, 22, 26, 30], hwm=18, batch=2)
+    assert tasks == [19, 20, 21, 23, 24, 25, 27, 28, 29]
+    assert hwm == 30
@@ -0,0 +1,60 @@
+import asyncio
+
+import tools
+from tools import RateLimiter
+
+
+def test_burst_then_refill(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tools.time.monotonic', lambda: now[0])
+    limiter = RateLimiter(rate=1, burst=3)
+    assert limiter.acquire('a', 5) == 3
+    assert limiter.acquire('a') == 0
+    now[0] += 2
+    assert limiter.acquire('a', 5) == 2
+    # 其他客户端不受影响
+    assert limiter.acquire('b', 2) == 2
+
+
+def test_refill_is_capped_at_burst(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tools.time.monotonic', lambda: now[0])
+    limiter = RateLimiter(rate=1, burst=3)
+    limiter.acquire('a', 3)
+    now[0] += 1000
+    assert limiter.acquire('a', 10) == 3
+
+
+def test_full_buckets_are_dropped_when_over_max_clients(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tools.time.monotonic', lambda: now[0])
+    limiter = RateLimiter(rate=1, burst=2, max_clients=2)
+    limiter.acquire('a', 2)
+    limiter.acquire('b', 2)
+    now[0] += 10
+    limiter.acquire('c', 1)
+    assert set(limiter.buckets) == {'c'}
+
+
+def test_refund_is_capped_at_burst(monkeypatch):
+    monkeypatch.setattr('tools.time.monotonic', lambda: 100.0)
+    limiter = RateLimiter(rate=1, burst=3)
+    assert limiter.acquire('a', 3) == 3
+    limiter.refund('a', 2)
+    assert limiter.acquire('a', 3) == 2
+    limiter.refund('a', 10)
+    assert limiter.acquire('a', 5) == 3
+
+
+def test_batch_lease_is_not_capped_by_worker_count():
+    assert tools.task_limiter.burst >= 10
+
+
+def test_polling_an_empty_queue_costs_nothing(monkeypatch, fake_db):
+    monkeypatch.setattr('tools.time.monotonic', lambda: 100.0)
+    monkeypatch.setattr(tools, 'task_limiter', RateLimiter(rate=0.1, burst=10))
+    fake_db('tools', task=[])
+    for _ in range(5):
+        lease = asyncio.run(tools.lease_tasks('a', 10))
+        assert lease.tasks == []
+    assert tools.task_limiter.acquire('a', 10) == 10
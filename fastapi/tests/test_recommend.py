@@ -0,0 +1,37 @@
+import datetime
+
+import recommend
+from fastjson import dumps
+from recommend import RecommendPool
+
+
+def pool(n):
+    p = RecommendPool('topic', dict, 'score')
+    p.items = [{'id': i} for i in range(n)]
+    p.encoded = [dumps(i) for i in p.items]
+    p.cum_weights = list(range(1, n + 1))
+    return p
+
+
+def test_small_pool_returns_everything():
+    assert sorted(pool(3).sample(10)) == [0, 1, 2]
+
+
+def test_sample_is_unique():
+    chosen = pool(50).sample(10)
+    assert len(chosen) == len(set(chosen)) == 10
+
+
+def test_models_are_returned_without_fast_json(monkeypatch):
+    monkeypatch.setattr(recommend, 'FAST_JSON', False)
+    assert sorted(i['id'] for i in pool(3).response()) == [0, 1, 2]
+
+
+def test_fast_json_body(monkeypatch):
+    monkeypatch.setattr(recommend, 'FAST_JSON', True)
+    assert pool(1).response().body == b'[{"id":0}]'
+
+
+def test_naive_datetime_keeps_isoformat():
+    date = datetime.datetime(2024, 1, 1, 12, 0, 0, 500)
+    assert dumps({'date': date}) == b'{"date":"%s"}' % date.isoformat().encode()
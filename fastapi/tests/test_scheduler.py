@@ -0,0 +1,40 @@
+import datetime
+
+from scheduler import select_with_quota, task_rank
+
+
+def tasks(*types):
+    return [{'_id': i, 'type': t} for i, t in enumerate(types)]
+
+
+def test_quota_caps_each_type():
+    candidates = tasks(*['change'] * 10, 'oldest', 'oldest', 'recent')
+    selected = select_with_quota(candidates, 5)
+    types = [i['type'] for i in selected]
+    assert len(selected) == 5
+    assert types.count('change') == 3  # ceil(5 * 0.6)
+    assert types.count('oldest') == 2
+
+
+def test_fills_up_in_rank_order_when_quota_exhausted():
+    candidates = tasks(*['change'] * 10)
+    selected = select_with_quota(candidates, 5)
+    assert [i['_id'] for i in selected] == [0, 1, 2, 3, 4]
+
+
+def test_returns_all_when_fewer_candidates():
+    assert len(select_with_quota(tasks('change', 'retry'), 5)) == 2
+
+
+def test_rank_prefers_change_but_ages_old_tasks():
+    now = datetime.datetime(2024, 1, 1)
+    assert task_rank('change', now=now) < task_rank('oldest', now=now)
+    # 排队两小时的 oldest 任务排在刚创建的 change 任务前面
+    assert task_rank('oldest', now=now - datetime.timedelta(hours=2)) < task_rank('change', now=now)
+
+
+def test_rank_boosts_fresh_active_topics():
+    now = datetime.datetime(2024, 1, 1)
+    hot = {'date': now - datetime.timedelta(hours=2), 'spiderTime': now, 'score': 500, 'reply': 50}
+    cold = {'date': now - datetime.timedelta(days=300), 'spiderTime': now, 'score': 0, 'reply': 0}
+    assert task_rank('recent', hot, now) < task_rank('recent', cold, now)
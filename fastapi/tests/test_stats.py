@@ -0,0 +1,33 @@
+import asyncio
+
+import stats
+from metrics import Gauge
+from stats import by_type, refresh_queue_depth
+
+
+def test_by_type_counts_each_type():
+    assert by_type('pending', ['change', 'recent', 'change', None], -1) == {
+        'task_types.pending.change': -2,
+        'task_types.pending.recent': -1,
+        'task_types.pending.unknown': -1,
+    }
+
+
+def test_queue_depth_by_type_and_state(monkeypatch):
+    gauge = Gauge('test_queue_depth', 'test', ('type', 'state'))
+    monkeypatch.setattr(stats, 'queue_depth', gauge)
+
+    async def get_stats():
+        return {'task_types': {
+            'total': {'change': 10, 'oldest': 3},
+            'pending': {'change': 4},
+            'not_complete': {'change': 6, 'oldest': 3},
+        }}
+
+    monkeypatch.setattr(stats, 'get_stats', get_stats)
+    asyncio.run(refresh_queue_depth())
+    assert gauge.get(type='change', state='pending') == 4
+    assert gauge.get(type='change', state='leased') == 2
+    assert gauge.get(type='change', state='completed') == 4
+    assert gauge.get(type='oldest', state='leased') == 3
+    assert gauge.get(type='oldest', state='completed') == 0
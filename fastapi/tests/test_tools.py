@@ -0,0 +1,81 @@
+import datetime
+import asyncio
+
+from pymongo import UpdateOne
+
+from tools import not_modified, http_date, diff_ops, fingerprint, FINGERPRINT_FIELDS
+
+
+ETAG = '"abc"'
+MODIFIED = datetime.datetime(2024, 1, 1, 12, 0, 0, 500000)
+
+
+def test_matching_etag():
+    assert not_modified({'If-None-Match': '"x", "abc"'}, ETAG)
+    assert not_modified({'If-None-Match': '*'}, ETAG)
+    assert not not_modified({'If-None-Match': '"x"'}, ETAG)
+
+
+def test_weak_etag_matches():
+    assert not_modified({'If-None-Match': 'W/"abc"'}, ETAG)
+
+
+def test_etag_takes_precedence_over_date():
+    headers = {'If-None-Match': '"x"', 'If-Modified-Since': http_date(MODIFIED)}
+    assert not not_modified(headers, ETAG, MODIFIED)
+
+
+def test_if_modified_since_ignores_sub_second_precision():
+    assert not_modified({'If-Modified-Since': http_date(MODIFIED)}, ETAG, MODIFIED)
+    later = MODIFIED + datetime.timedelta(seconds=5)
+    assert not not_modified({'If-Modified-Since': http_date(MODIFIED)}, ETAG, later)
+
+
+def test_bad_date_is_not_a_match():
+    assert not not_modified({'If-Modified-Since': 'yesterday'}, ETAG, MODIFIED)
+    assert not not_modified({}, ETAG, MODIFIED)
+
+
+def stored(fake_db, kind, docs):
+    fp = {i['id']: {g: fingerprint(i, f) for g, f in FINGERPRINT_FIELDS[kind].items()} for i in docs}
+    fake_db('tools', **{kind: [{'id': k, 'fp': v} for k, v in fp.items()]})
+
+
+def reply(**kwargs):
+    doc = {'id': 1, 'topicId': 1, 'topicPage': 1, 'author': 'a', 'avatar': '', 'date': MODIFIED,
+           'content': 'hello', 'thank': 1, 'spiderTime': MODIFIED}
+    return {**doc, **kwargs}
+
+
+def test_unchanged_doc_only_touches_spider_time(fake_db):
+    stored(fake_db, 'reply', [reply()])
+    ops, changed = asyncio.run(diff_ops('reply', [reply()]))
+    assert changed == []
+    assert ops == [UpdateOne({'id': 1}, {'$set': {'spiderTime': MODIFIED}})]
+
+
+def test_counter_change_is_returned(fake_db):
+    stored(fake_db, 'reply', [reply()])
+    ops, changed = asyncio.run(diff_ops('reply', [reply(thank=2)]))
+    assert [i['thank'] for i in changed] == [2]
+    assert ops == [UpdateOne({'id': 1}, {'$set': {
+        'spiderTime': MODIFIED, 'thank': 2, 'fp.counters': fingerprint(reply(thank=2), ['thank']),
+    }})]
+
+
+def test_content_change_is_returned_for_leaderboard(fake_db):
+    stored(fake_db, 'reply', [reply()])
+    ops, changed = asyncio.run(diff_ops('reply', [reply(content='edited')]))
+    assert [i['content'] for i in changed] == ['edited']
+    fields = FINGERPRINT_FIELDS['reply']['content']
+    edited = reply(content='edited')
+    assert ops == [UpdateOne({'id': 1}, {'$set': {
+        'spiderTime': MODIFIED, **{i: edited[i] for i in fields}, 'fp.content': fingerprint(edited, fields),
+    }})]
+
+
+def test_new_doc_is_upserted(fake_db):
+    stored(fake_db, 'reply', [])
+    ops, changed = asyncio.run(diff_ops('reply', [reply()]))
+    assert changed == [reply()]
+    assert len(ops) == 1
@@ -0,0 +1,49 @@
+import datetime
+import asyncio
+
+import weekly
+from leaderboard import LOCAL_TZ
+
+SATURDAY = datetime.datetime(2024, 1, 6, tzinfo=LOCAL_TZ)
+
+
+def boards(version):
+    topic = {'id': 1, 'score': 10, 'name': 't', 'node': 'qna', 'author': 'a', 'date': SATURDAY}
+    return [{'period': '2024-01-06', 'version': version, 'items': [topic]}]
+
+
+def count_top(monkeypatch):
+    calls = []
+    real = weekly.top
+
+    async def top(*args):
+        calls.append(args[0])
+        return await real(*args) if args[0] == 'topic' else []
+
+    monkeypatch.setattr(weekly, 'top', top)
+    monkeypatch.setattr(weekly, 'drafts', {})
+    return calls
+
+
+def test_draft_is_reused_until_leaderboard_changes(monkeypatch, fake_db):
+    calls = count_top(monkeypatch)
+    fake_db('weekly', weekly=[{'_id': 1, 'title': '上一期', 'id': 100}])
+    db = fake_db('leaderboard', leaderboard=boards(1))
+
+    first = asyncio.run(weekly.generate_weekly(SATURDAY))
+    assert asyncio.run(weekly.generate_weekly(SATURDAY)) == first
+    assert len(calls) == 2
+
+    db.leaderboard.docs = boards(2)
+    asyncio.run(weekly.generate_weekly(SATURDAY))
+    assert len(calls) == 4
+
+
+def test_fresh_ignores_draft(monkeypatch, fake_db):
+    calls = count_top(monkeypatch)
+    fake_db('weekly', weekly=[{'_id': 1, 'title': '上一期', 'id': 100}])
+    fake_db('leaderboard', leaderboard=boards(1))
+
+    asyncio.run(weekly.generate_weekly(SATURDAY))
+    asyncio.run(weekly.generate_weekly(SATURDAY, fresh=True))
+    assert len(calls) == 4
@@ -1,14 +1,21 @@
-from functools import wraps
+from pymongo import UpdateOne
 from bson import ObjectId
+from typing import List
 import datetime
-import aiohttp
-import random
+import asyncio
 import base64
+import hashlib
+import email.utils
 import time
+import os
 import re
 
 from database import db
-from model import Task
+from metrics import ingest_writes, ingest_skip_ratio
+from stats import incr, by_type
+from httpclient import http, response_cookies, V2EX_URL, TG_URL
+from scheduler import task_rank, select_with_quota
+from model import Task, TaskLease
 
 
 def localtime(dt):
@@ -20,23 +27,47 @@ def dt_format(dt, format = '%Y-%m-%d %H:%M:%S'):
 def remove_tag_a(html):
     return re.sub('<a .*?>|</a>', '', html)
 
+def http_date(dt):
+    return email.utils.format_datetime(dt.replace(tzinfo=datetime.timezone.utc) if dt.tzinfo is None else dt, usegmt=True)
+
+def not_modified(headers, etag, last_modified=None):
+    '''根据 If-None-Match / If-Modified-Since 判断客户端缓存是否仍然有效'''
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        # If-None-Match 使用弱比较，忽略 W/ 前缀
+        weak = lambda tag: tag.strip().removeprefix('W/')
+        return if_none_match.strip() == '*' or weak(etag) in [weak(i) for i in if_none_match.split(',')]
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified:
+        try:
+            return email.utils.parsedate_to_datetime(if_modified_since) >= email.utils.parsedate_to_datetime(http_date(last_modified))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# 列表页渲染所需字段，不取正文等大字段
+TOPIC_LIST_FIELDS = ['id', 'name', 'node', 'author', 'avatar', 'date', 'score']
+REPLY_LIST_FIELDS = ['id', 'topicId', 'topicPage', 'author', 'avatar', 'date', 'thank', 'content']
+
+
+# 错误码 -> 错误内容中的关键字，其余归为 other
+ERROR_CODES = {
+    '404': '错误码404',
+    '502': '错误码502',
+    '403': '错误码403',
+    'post': 'at post',
+}
 
-# 内存缓存 过期数据只有重启才会清理
-def cache(expiration_time=60):
-    cached_results = {}
 
-    def wrapper(func):
-        @wraps(func)
-        async def inner(*args, **kwargs):
-            if args in cached_results:
-                result, timestamp = cached_results[args]
-                if time.time() - timestamp < expiration_time:
-                    return result
-            result = await func(*args, **kwargs)
-            cached_results[args] = (result, time.time())
-            return result
-        return inner
-    return wrapper
+def parse_error(url: str, error: str) -> dict:
+    '''从错误地址及内容中解析出主题 ID、页码及错误码'''
+    result = re.search(r'/t/(\d+)', url)
+    topic_id = int(result.group(1)) if result else None
+    page = re.search(r'=(\d+)', url)
+    page = int(page.group(1)) if page else 1
+    code = next((k for k, v in ERROR_CODES.items() if v in error), 'other')
+    return {'topic_id': topic_id, 'page': page, 'code': code}
 
 
 def page_range(num: int, page_num: int = 100) -> list:
@@ -47,56 +78,276 @@ def page_range(num: int, page_num: int = 100) -> list:
         return [1]
 
 
-async def new_task(id: int, page: int, task_type: str):
-    '''新建爬虫任务'''
-
-    await db.task.update_one(
+def task_op(id: int, page: int, task_type: str, topic: dict = None) -> UpdateOne:
+    return UpdateOne(
         {'id': id, 'page': page},
         {"$set": {
             'id': id,
             'page': page,
             'distribute_time': None,
             'complete_time': None,
+            'lease': None,
+            'lease_expire': None,
             'type': task_type,
+            'rank': task_rank(task_type, topic),
         }},
     upsert=True)
 
 
-async def get_task():
-    '''获取爬虫任务（分配）'''
-    # 更新速度可以放慢一半
-    if random.random() >= 0.3:
-        return Task(sign='',id=0,page=0,url='')
+async def new_tasks(tasks):
+    '''批量新建爬虫任务
 
-    task = await db.task.find_one_and_update({
-        'distribute_time': None,
+    tasks 为 (id, page, type) 或 (id, page, type, topic) 的可迭代对象，
+    带上主题信息（date、spiderTime、score、reply）可以算出更准确的优先级'''
+    tasks = list(tasks)
+    ops = [task_op(*i) for i in tasks]
+    if ops:
+        result = await db.task.bulk_write(ops, ordered=False)
+        # 已存在的任务被重置时原状态未知，由定时统计修正
+        new = result.upserted_count
+        types = [tasks[i][2] for i in result.upserted_ids]
+        await incr(
+            task_total=new, task_pending=new, task_not_complete=new,
+            **by_type('total', types), **by_type('pending', types), **by_type('not_complete', types),
+        )
+
+
+async def new_task(id: int, page: int, task_type: str, topic: dict = None):
+    '''新建爬虫任务'''
+    await new_tasks([(id, page, task_type, topic)])
+
+
+class RateLimiter:
+    '''按客户端的令牌桶限流，rate 为每秒补充的令牌数'''
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = {}  # client -> (tokens, timestamp)
+
+    def acquire(self, client: str, n: int = 1) -> int:
+        '''申请最多 n 个令牌，返回实际获得的数量'''
+        now = time.monotonic()
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        granted = min(n, int(tokens))
+        if len(self.buckets) >= self.max_clients and client not in self.buckets:
+            # 清理令牌已回满的客户端
+            self.buckets = {k: v for k, v in self.buckets.items()
+                            if v[0] + (now - v[1]) * self.rate < self.burst}
+        self.buckets[client] = (tokens - granted, now)
+        return granted
+
+    def refund(self, client: str, n: int):
+        '''归还申请后没有用上的令牌'''
+        if n > 0 and client in self.buckets:
+            tokens, last = self.buckets[client]
+            self.buckets[client] = (min(self.burst, tokens + n), last)
+
+
+# gunicorn 的 worker 数（由 gunicorn.conf.py 写入环境变量），进程内状态按此均分
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# 每个客户端平均 10 秒一个任务，最多积攒 10 个
+# 令牌桶在各 worker 进程中独立，请求大致均匀分到各 worker，补充速度按 worker 数均分后总体约为设定值；
+# 积攒上限不均分，保证单次批量租用能拿到 10 个
+task_limiter = RateLimiter(rate=0.1 / WORKERS, burst=10)
+
+LEASE_SECONDS = 60
+MAX_LEASE_TASKS = 50
+
+
+def task_url(task):
+    return '/t/%s?p=%s' % (task['id'], task['page'])
+
+
+async def lease_tasks(client: str, n: int = 1, seconds: int = LEASE_SECONDS) -> TaskLease:
+    '''批量租用爬虫任务，租约过期的任务在此处直接回收重新分配'''
+    now = datetime.datetime.now()
+    expire = now + datetime.timedelta(seconds=seconds)
+    lease = TaskLease(lease=str(ObjectId()), expire=expire, tasks=[])
+
+    n = task_limiter.acquire(client, min(n, MAX_LEASE_TASKS))
+    if not n:
+        return lease
+
+    available = {
+        'complete_time': None,
+        '$or': [
+            {'distribute_time': None},
+            {'lease_expire': {'$lte': now}},
+        ]
+    }
+    # 多取一些候选以便按类型配额挑选
+    candidates = await db.task.find(available, {'_id': 1, 'type': 1, 'distribute_time': 1}) \
+        .sort([('rank', 1), ('_id', 1)]).limit(n * 4).to_list(n * 4)
+    candidates = select_with_quota(candidates, n)
+    if not candidates:
+        # 只对实际租到的任务扣除令牌，队列为空时轮询不消耗额度
+        task_limiter.refund(client, n)
+        return lease
+
+    # 条件更新保证并发时同一任务只会被一个租约拿到
+    await db.task.update_many({
+        '_id': {'$in': [i['_id'] for i in candidates]},
+        **available,
     }, {
         '$set': {
-            'distribute_time': datetime.datetime.now()
+            'distribute_time': now,
+            'lease': lease.lease,
+            'lease_expire': expire,
         }
-    }, sort=[('_id', 1)])
-    
-    if not task:
-        return Task(sign='',id=0,page=0,url='')
-
-    url = '/t/%s?p=%s' % (task['id'], task['page'])
-    return Task(
-        sign=str(task['_id']),
-        id=task['id'],
-        page=task['page'],
-        url=url
-    )
+    })
+    tasks = await db.task.find({'lease': lease.lease}).to_list(n)
+    task_limiter.refund(client, n - len(tasks))
+    # 回收的过期租约原本就不计入未分配
+    leased = {i['_id'] for i in tasks}
+    pending = [i['type'] for i in candidates if i['_id'] in leased and i.get('distribute_time') is None]
+    await incr(task_pending=-len(pending), **by_type('pending', pending, -1))
+    lease.tasks = [Task(sign=str(i['_id']), id=i['id'], page=i['page'], url=task_url(i)) for i in tasks]
+    return lease
+
+
+async def renew_tasks(lease: str, signs: List[str], seconds: int = LEASE_SECONDS) -> int:
+    '''续租，返回续租成功的任务数'''
+    result = await db.task.update_many({
+        '_id': {'$in': [ObjectId(i) for i in signs if ObjectId.is_valid(i)]},
+        'lease': lease,
+        'complete_time': None,
+    }, {
+        '$set': {
+            'lease_expire': datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+        }
+    })
+    return result.modified_count
 
 
-async def complete_task(sign):
-    '''完成爬虫任务'''
-    await db.task.find_one_and_update({
-        '_id': ObjectId(sign)
-    }, {
+async def complete_tasks(filter: dict) -> int:
+    '''完成符合条件的未完成任务并按类型更新统计，返回完成的任务数'''
+    filter = {**filter, 'complete_time': None}
+    tasks = await db.task.find(filter, {'type': 1}).to_list(None)
+    if not tasks:
+        return 0
+    result = await db.task.update_many({**filter, '_id': {'$in': [i['_id'] for i in tasks]}}, {
         '$set': {
             'complete_time': datetime.datetime.now()
         }
     })
+    # 并发完成同一任务时按类型的计数可能偏多，由定时统计修正
+    await incr(task_not_complete=-result.modified_count, **by_type('not_complete', [i.get('type') for i in tasks], -1))
+    return result.modified_count
+
+
+async def ack_tasks(lease: str, signs: List[str]) -> int:
+    '''批量完成任务，返回确认成功的任务数'''
+    return await complete_tasks({
+        '_id': {'$in': [ObjectId(i) for i in signs if ObjectId.is_valid(i)]},
+        'lease': lease,
+    })
+
+
+async def get_task(client: str):
+    '''获取单个爬虫任务（分配）'''
+    lease = await lease_tasks(client, 1)
+    if not lease.tasks:
+        return Task(sign='',id=0,page=0,url='')
+    return lease.tasks[0]
+
+
+async def complete_task(sign):
+    '''完成爬虫任务'''
+    await complete_tasks({'_id': ObjectId(sign)})
+
+
+# TEMP 临时排除浏览状态提交的回复（其他插件影响内容）
+REPLY_EXCLUDE = re.compile(re.escape('<div class="show-reply">') + '|' + re.escape('的这条回复发送感谢'))
+
+
+# 指纹分组: 正文等大字段与计数分开，只写入变化的分组
+FINGERPRINT_FIELDS = {
+    'topic': {
+        'content': ['name', 'node', 'author', 'avatar', 'date', 'content', 'append'],
+        'counters': ['reply', 'vote', 'click', 'collect', 'thank', 'score'],
+    },
+    'reply': {
+        'content': ['topicId', 'topicPage', 'author', 'avatar', 'date', 'content'],
+        'counters': ['thank'],
+    },
+}
+
+
+def fingerprint(doc: dict, fields: list) -> str:
+    return hashlib.blake2b(repr([doc.get(i) for i in fields]).encode(), digest_size=8).hexdigest()
+
+
+async def diff_ops(kind: str, docs: list):
+    '''对比已存指纹生成写操作，返回 (写操作, 新增或有变化的文档)
+
+    未变化的分组不再写入，只更新 spiderTime；
+    内容变化的文档也要返回，已上榜时由 update_leaderboard 刷新榜单中的副本'''
+    if not docs:
+        return [], []
+    groups = FINGERPRINT_FIELDS[kind]
+    existing = await db[kind].find(
+        {'id': {'$in': [i['id'] for i in docs]}}, {'id': 1, 'fp': 1, '_id': 0}
+    ).to_list(None)
+    existing = {i['id']: i.get('fp') or {} for i in existing}
+
+    ops, changed = [], []
+    for doc in docs:
+        fp = {group: fingerprint(doc, fields) for group, fields in groups.items()}
+        old = existing.get(doc['id'])
+        if old is None:
+            ops.append(UpdateOne({'id': doc['id']}, {'$set': {**doc, 'fp': fp}}, upsert=True))
+            changed.append(doc)
+            ingest_writes.inc(kind=kind, result='new')
+            continue
+
+        update = {'spiderTime': doc['spiderTime']}
+        for group, fields in groups.items():
+            if old.get(group) != fp[group]:
+                update.update({i: doc[i] for i in fields})
+                update[f'fp.{group}'] = fp[group]
+        if len(update) > 1:
+            changed.append(doc)
+        ops.append(UpdateOne({'id': doc['id']}, {'$set': update}))
+        ingest_writes.inc(kind=kind, result='changed' if len(update) > 1 else 'touch')
+
+    total = sum(ingest_writes.get(kind=kind, result=i) for i in ('new', 'changed', 'touch'))
+    ingest_skip_ratio.set(ingest_writes.get(kind=kind, result='touch') / total if total else 0, kind=kind)
+    return ops, changed
+
+
+def split_replys(topics: list) -> list:
+    '''取出主题中的回复，过滤掉不保存的回复'''
+    replys = []
+    for topic in topics:
+        replys += [i for i in topic.pop('replys') or [] if not REPLY_EXCLUDE.search(i['content'])]
+    return replys
+
+
+async def save_topics(topics: list, replys: list, tasks: list = ()):
+    '''批量保存主题及回复，并完成对应爬虫任务
+
+    返回需要更新榜单的主题及回复
+    主题、回复、任务各一次无序 bulk_write，三者并发执行'''
+    (topic_ops, topic_changed), (reply_ops, reply_changed) = await asyncio.gather(
+        diff_ops('topic', topics),
+        diff_ops('reply', replys),
+    )
+
+    task_ids = [ObjectId(i) for i in tasks if ObjectId.is_valid(i)]
+
+    jobs = []
+    if topic_ops:
+        jobs.append(db.topic.bulk_write(topic_ops, ordered=False))
+    if reply_ops:
+        jobs.append(db.reply.bulk_write(reply_ops, ordered=False))
+    if task_ids:
+        jobs.append(complete_tasks({'_id': {'$in': task_ids}}))
+    await asyncio.gather(*jobs)
+    return {'topic': topic_changed, 'reply': reply_changed}
 
 
 async def send_msg_to_tg(message):
@@ -104,19 +355,18 @@ async def send_msg_to_tg(message):
     
     print(message)
     bot_token = "6166416562:AAEoN6dIlqM0Lf13lhnOEZyzcwC1fR4YKVM" # token 没什么价值
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{TG_URL}/bot{bot_token}/sendMessage"
     payload = {
         "chat_id": "-203039215",
         "text": message
     }
 
-    async with aiohttp.request('POST', url, json=payload) as r:
-        return await r.json()
+    r = await http.fetch('POST', url, json=payload)
+    return await r.json()
 
 
 headers = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.152 Safari/537.36",
-    "Host": "www.v2ex.com",
     "Referer": "https://www.v2ex.com/signin",
     "Origin": "https://www.v2ex.com"
 }
@@ -124,33 +374,32 @@ headers = {
 async def get_login_info():
     '''获取 V 站登录信息'''
 
-    async with aiohttp.ClientSession(headers=headers) as session:
-        async with session.get('https://v2ex.com/signin') as rep:
-            html = await rep.text()
-            # 获取 once
-            once = re.search(r"value=\"(\d+?)\" name=\"once\"", html)
-            if once:
-                once = str(once.group(1))
-            else:
-                return '登陆页面无法获取到 once' + html
-
-            # 获取tokens,cookies
-            tokens = re.findall('class="sl" name="(.*?)"', html)
-            cookies = session.cookie_jar.filter_cookies('https://v2ex.com')
-
-        # 请求验证码
-        async with session.get('https://v2ex.com/_captcha?once=' + once) as rep:
-            # 得到验证码图片的base64编码
-            img_content = await rep.read()
-            img_b64 = base64.b64encode(img_content).decode('ascii')
-        
-        print(cookies)
-        return {
-            'once': once,
-            'tokens': tokens,
-            'session': cookies['PB3_SESSION'].value,
-            'img': img_b64
-        }
+    rep = await http.fetch('GET', f'{V2EX_URL}/signin', headers=headers)
+    html = await rep.text()
+    # 获取 once
+    once = re.search(r"value=\"(\d+?)\" name=\"once\"", html)
+    if once:
+        once = str(once.group(1))
+    else:
+        return '登陆页面无法获取到 once' + html
+
+    # 获取tokens,cookies
+    tokens = re.findall('class="sl" name="(.*?)"', html)
+    cookies = response_cookies(rep)
+
+    # 请求验证码
+    rep = await http.fetch('GET', f'{V2EX_URL}/_captcha?once=' + once, headers=headers, cookies=cookies)
+    # 得到验证码图片的base64编码
+    img_content = rep.body
+    img_b64 = base64.b64encode(img_content).decode('ascii')
+
+    print(cookies)
+    return {
+        'once': once,
+        'tokens': tokens,
+        'session': cookies['PB3_SESSION'],
+        'img': img_b64
+    }
 
 async def login_get_a2(captcha, pwd, once, session, u, p, o):
     '''登录获取 A2'''
@@ -167,72 +416,18 @@ async def login_get_a2(captcha, pwd, once, session, u, p, o):
         'next': '/'
     }
     
-    async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-        async with session.post('https://v2ex.com/signin', params=payload, allow_redirects=True) as r:
-            html = await r.text()
-
-            cookies = session.cookie_jar.filter_cookies('https://v2ex.com')
-            A2 = cookies.get('A2')
-            if not A2:
-                return '登录失败' + html
+    # 登录请求不重试，避免重复提交验证码
+    r = await http.fetch('POST', f'{V2EX_URL}/signin', retries=0, headers=headers, cookies=cookies, params=payload, allow_redirects=True)
+    html = await r.text()
+    A2 = response_cookies(r).get('A2')
+    if not A2:
+        return '登录失败' + html
             
     db.info.update_one({}, {
         '$set': {
-            'A2': A2.value,
+            'A2': A2,
             'A2_update': datetime.datetime.now()
         }
     })
     await send_msg_to_tg('A2 更新成功')
     return '操作成功，A2 更新成功'
-
-
-
-async def generate_weekly(saturday):
-    '''获取周六至周五的周报'''
-    
-    friday = saturday + datetime.timedelta(days=6,hours=23,minutes=59) 
-
-    title = f'✨ V2EX 周报 本周热门主题及高赞回复 {saturday:%m.%d}-{friday:%m.%d}'
-
-    topics = await db.topic.find({
-        "date": {"$gte": saturday, "$lt": friday}
-    }).sort("score", -1).limit(30).to_list(30)
-    
-    replys = await db.reply.find({
-        "date": {"$gte": saturday, "$lt": friday}
-    }).sort("thank", -1).limit(30).to_list(30)
-
-    content = '🙋‍♂️ vDaily 每周日为您统计本周内的热门主题和高赞回复  \n\n'
-    content += '🛠️ 推荐使用站内流行的浏览器扩展: [V2EX Plus](https://chrome.google.com/webstore/detail/v2ex-plus/daeclijmnojoemooblcbfeeceopnkolo)  \n'
-    content += '***\n'
-    content += '### 🎉 热门主题\n'
-    for i in topics:
-        info = f'{i["author"]} · {i["node"]} · {localtime(i["date"]):%Y-%m-%d}'
-        content += f'> [{i["score"]: >6} ➰ **{i["name"]}**  \n&emsp;&emsp;&emsp;&emsp;&emsp;&ensp;{info}](https://v2ex.com/t/{i["id"]})  \n\n'
-        
-
-    replys = await db.reply.find({
-        "date": {"$gte": saturday, "$lt": friday}
-     }).sort("thank", -1).limit(15).to_list(15)
-
-    content += '***\n'
-    content += '### 💕 高赞回复\n'
-
-    for i in replys:
-        url = f'https://v2ex.com/t/{i["topicId"]}?p={i["topicPage"]}#r_{i["id"]}'
-        reply = remove_tag_a(i['content']).replace("<br>", " ") # 移除 <a> <br>
-        reply = re.sub(r'(.+imgur.+)(\.)', r'\1s.', reply) # 调整 imgur 大小
-        info = f'{i["author"]} · {localtime(i["date"]):%Y-%m-%d}'
-        content += f'> [{i["thank"]: >9} ➰ **{ reply }**  \n&emsp;&emsp;&emsp;&emsp;&emsp;&ensp;{info}]({ url })  \n\n'
-
-    lastWeekly = await db.weekly.find_one({}, sort=[('_id', -1)])
-
-    content += '***\n'
-    content += f'🔗 回顾上一期周报: [{lastWeekly["title"]}](https://v2ex.com/t/{lastWeekly["id"]})  \n'
-    content += '🌐 查看更多优质主题及回复: [V2EX 精选](https://vdaily.huguotao.com)  \n'
-    content += '🥇 主题及回复排行榜: [V2EX 排行](https://vdaily.huguotao.com/rank)  \n'
-    content += '⚙️ 到这里选择您喜欢的 V 站主题样式: [V2EX 样式商城](https://vdaily.huguotao.com/store)  \n'
-    content += '📰 RSS 订阅: [Atom](https://vdaily.huguotao.com/weekly/atom.xml)  \n'
-    content += '✉️ 欢迎任何交流及反馈: [sciooga@gmail.com](mailto:sciooga@gmail.com)  \n'
-    content += '\n周末愉快，下周再见👋'
-    return title, content
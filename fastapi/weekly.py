@@ -0,0 +1,92 @@
+import markdown
+import datetime
+import asyncio
+import re
+import io
+
+from database import db
+from tools import localtime, remove_tag_a
+from leaderboard import top, versions
+
+
+def render_weekly(content: str) -> dict:
+    '''渲染周报 HTML，移动端去掉 &emsp; 缩进'''
+    html = markdown.markdown(content)
+    return {'html': html, 'html_mobile': html.replace('&emsp;', '')}
+
+
+async def ensure_rendered(weekly: dict) -> dict:
+    '''旧周报没有预渲染内容时补上并保存'''
+    if 'html' not in weekly:
+        rendered = await asyncio.to_thread(render_weekly, weekly['content'])
+        weekly.update(rendered)
+        await db.weekly.update_one({'_id': weekly['_id']}, {'$set': rendered})
+    return weekly
+
+
+# ISO 周 -> (榜单版本, 标题, 内容)，榜单及上一期周报未变化时直接复用草稿
+drafts = {}
+
+
+def write_weekly(out, topics, replys, last_weekly):
+    '''写出周报 Markdown 正文'''
+    out.write('🙋‍♂️ vDaily 每周日为您统计本周内的热门主题和高赞回复  \n\n')
+    out.write('🛠️ 推荐使用站内流行的浏览器扩展: [V2EX Plus](https://chrome.google.com/webstore/detail/v2ex-plus/daeclijmnojoemooblcbfeeceopnkolo)  \n')
+    out.write('***\n')
+    out.write('### 🎉 热门主题\n')
+    for i in topics:
+        info = f'{i["author"]} · {i["node"]} · {localtime(i["date"]):%Y-%m-%d}'
+        out.write(f'> [{i["score"]: >6} ➰ **{i["name"]}**  \n&emsp;&emsp;&emsp;&emsp;&emsp;&ensp;{info}](https://v2ex.com/t/{i["id"]})  \n\n')
+
+    out.write('***\n')
+    out.write('### 💕 高赞回复\n')
+    for i in replys:
+        url = f'https://v2ex.com/t/{i["topicId"]}?p={i["topicPage"]}#r_{i["id"]}'
+        reply = remove_tag_a(i['content']).replace("<br>", " ") # 移除 <a> <br>
+        reply = re.sub(r'(.+imgur.+)(\.)', r'\1s.', reply) # 调整 imgur 大小
+        info = f'{i["author"]} · {localtime(i["date"]):%Y-%m-%d}'
+        out.write(f'> [{i["thank"]: >9} ➰ **{ reply }**  \n&emsp;&emsp;&emsp;&emsp;&emsp;&ensp;{info}]({ url })  \n\n')
+
+    out.write('***\n')
+    out.write(f'🔗 回顾上一期周报: [{last_weekly["title"]}](https://v2ex.com/t/{last_weekly["id"]})  \n')
+    out.write('🌐 查看更多优质主题及回复: [V2EX 精选](https://vdaily.huguotao.com)  \n')
+    out.write('🥇 主题及回复排行榜: [V2EX 排行](https://vdaily.huguotao.com/rank)  \n')
+    out.write('⚙️ 到这里选择您喜欢的 V 站主题样式: [V2EX 样式商城](https://vdaily.huguotao.com/store)  \n')
+    out.write('📰 RSS 订阅: [Atom](https://vdaily.huguotao.com/weekly/atom.xml)  \n')
+    out.write('✉️ 欢迎任何交流及反馈: [sciooga@gmail.com](mailto:sciooga@gmail.com)  \n')
+    out.write('\n周末愉快，下周再见👋')
+
+
+async def generate_weekly(saturday, fresh: bool = False):
+    '''获取周六至周五的周报，fresh 为 True 时忽略草稿重新生成（发布时使用）'''
+    
+    friday = saturday + datetime.timedelta(days=6,hours=23,minutes=59) 
+
+    title = f'✨ V2EX 周报 本周热门主题及高赞回复 {saturday:%m.%d}-{friday:%m.%d}'
+
+    # 先只读各期榜单的版本号，没有变化时不再读取榜单内容
+    topic_version, reply_version, last_weekly = await asyncio.gather(
+        versions('topic', saturday, friday),
+        versions('reply', saturday, friday),
+        db.weekly.find_one({}, {'title': 1, 'id': 1}, sort=[('_id', -1)]),
+    )
+    version = (topic_version, reply_version, last_weekly and last_weekly['_id'])
+    week = saturday.isocalendar()[:2]
+    draft = drafts.get(week)
+    if draft and not fresh and draft[0] == version:
+        return draft[1:]
+
+    topics, replys = await asyncio.gather(
+        top('topic', saturday, friday, 30),
+        top('reply', saturday, friday, 15),
+    )
+
+    out = io.StringIO()
+    write_weekly(out, topics, replys, last_weekly)
+    content = out.getvalue()
+
+    # 只保留最近几周的草稿
+    for i in sorted(drafts)[:-3]:
+        del drafts[i]
+    drafts[week] = (version, title, content)
+    return title, content